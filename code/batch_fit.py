@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------------------------------
+
+Headless batch fitting of the whole light curve catalog
+
+Fits every grb_object in grbdict on a pool of worker processes and
+streams one JSON line per burst to disk as each fit finishes.
+
+python batch_fit.py --dir /Users/jracusin/GRBs/ --out lc_fits.jsonl --nproc 8
+
+------------------------------------------------------------------------
+"""
+
+import sys
+import matplotlib
+if 'matplotlib.pyplot' not in sys.modules:
+	matplotlib.use('Agg')
+
+import numpy as np
+import json
+import math
+import multiprocessing
+import signal
+import threading
+import time
+import traceback
+import zlib
+import fit_lc
+from fit_lc import lc_arrays
+
+## not an Exception, so the fitters' handling of failed fits lets it through
+class FitTimeout(BaseException):
+	pass
+
+def _alarm(signum,frame):
+	raise FitTimeout()
+
+def _init_worker():
+
+	## workers never open windows and leave ctrl-c to the parent
+	fit_lc.plot.switch_backend('Agg')
+	signal.signal(signal.SIGINT,signal.SIG_IGN)
+
+def previous_fit_guess(lc,lcfit):
+
+	## initial conditions from an existing fit (grb.lcfit), otherwise a
+	## single power law fit in log-log space
+
+	if lcfit and (lcfit.model != 'nofit'):
+		p0=np.array(lcfit.par,dtype=float)
+		model=lcfit.model
+		pnames=lcfit.pnames
+	else:
+		p0,yfit,pnames=fit_lc.lc_linfit(np.array(lc['Time']),np.array(lc['Rate']),[])
+		model='pow'
+
+	return p0,model,fit_lc.fit_functions.models,pnames
+
+def auto_guess(lc,lcfit):
+
+	## initial conditions found from the light curve alone
+
+	return fit_lc.auto_initial_conditions(lc=lc)
+
+def fit_one(task):
+
+	## fit a single burst, never raises: failures and timeouts are
+	## returned as a status in the result record
+
+	grb,lc,lcfit,guess,timeout,opts=task
+	result={'grb':grb}
+	t0=time.time()
+	if timeout:
+		signal.signal(signal.SIGALRM,_alarm)
+		signal.alarm(int(math.ceil(timeout)))
+	try:
+		p0,model,fmodel,pnames=guess(lc,lcfit)
+		fit_opts=dict(opts)
+		nstarts=fit_opts.pop('nstarts',1)
+		if nstarts > 1:
+			p=fit_lc.multistart_fit(lc,p0,model,pnames=pnames,nstarts=nstarts,**fit_opts)
+		else:
+			p=fit_lc.fit_lc_model(lc,p0,model,fmodel=fmodel,pnames=pnames,**fit_opts)
+		result.update(fit_record(p))
+		## cstat fits whose minimizer did not report convergence
+		result['status']='ok' if getattr(p,'success',True) else 'unconverged'
+	except FitTimeout:
+		result['status']='timeout'
+	except Exception:
+		result['status']='error'
+		result['error']=traceback.format_exc().strip().split('\n')[-1]
+	finally:
+		if timeout:
+			signal.alarm(0)
+	result['time']=time.time()-t0
+	result.update(opts)
+
+	return result
+
+def fit_record(p):
+
+	## JSON-serializable dictionary of a fit_params object, with the
+	## minimizer's success and message for cstat fits
+
+	r={'model':p.model,
+		'pnames':[str(n) for n in p.pnames],
+		'par':[float(v) for v in p.par],
+		'perror':[[float(v) for v in e] for e in p.perror],
+		'chisq':float(p.chisq),
+		'dof':float(p.dof)}
+	if hasattr(p,'success'):
+		r['success']=bool(p.success)
+		r['message']=str(p.message)
+
+	return r
+
+def fit_catalog(grbdict,outfile,nproc=None,timeout=300.,guess=auto_guess,grbs=None,stat='chisq',\
+	errors='covar',nboot=200,boot_time=None,solver='curve_fit',nstarts=1):
+
+	## fit every burst in grbdict (or just the names in grbs) on nproc
+	## worker processes, appending one JSON line per burst to outfile as
+	## soon as it finishes. Light curves are only loaded as their bursts
+	## are dispatched. guess(lc,lcfit) gives the initial conditions
+	## (auto_guess or previous_fit_guess). stat is the fit statistic of
+	## fit_lc.fit_lc_model, or a dictionary {grb: stat} to choose it per
+	## burst ('chisq' for the others). errors is the error method of
+	## fit_lc.fit_lc_model, for 'bootstrap' with nboot refits and a budget
+	## of boot_time seconds per burst. solver is fit_lc.fit_lc_model's
+	## solver for stat='chisq'. nstarts > 1 fits each burst from that many
+	## starting points (fit_lc.multistart_fit, serially inside each worker).
+	## Returns a dictionary of status counts.
+
+	fit_lc.plot.switch_backend('Agg')
+	if nproc is None:
+		nproc=multiprocessing.cpu_count()
+	if grbs is None:
+		grbs=sorted(grbdict.keys())
+
+	def burst_options(grb):
+		if isinstance(stat,dict):
+			s=stat.get(grb,'chisq')
+		else:
+			s=stat
+		opts={'stat':s,'errors':errors}
+		if s == 'chisq':
+			opts['solver']=solver
+		if nstarts > 1:
+			opts['nstarts']=nstarts
+		if (errors in ('mcmc','bootstrap')) or (nstarts > 1):
+			## reproducible per burst, whatever worker it runs on
+			opts['seed']=zlib.crc32(grb.encode('utf-8')) & 0x7fffffff
+		if errors == 'bootstrap':
+			## the refits run serially inside each worker
+			opts.update({'nboot':nboot,'maxtime':boot_time,'nproc':1})
+		return opts
+
+	## light curves are read (through grb_object's cache) only as their
+	## tasks are dispatched, at most 2*nproc ahead of the finished fits
+	ahead=threading.Semaphore(2*nproc)
+	stop=[]
+	def tasks():
+		for grb in grbs:
+			ahead.acquire()
+			if stop:
+				return
+			g=grbdict[grb]
+			lc=g.lc
+			if not lc:
+				ahead.release()
+				continue
+			yield (grb,lc_arrays(lc),g.lcfit,guess,timeout,burst_options(grb))
+
+	print('Fitting '+str(len(grbs))+' GRBs on '+str(nproc)+' processes')
+	counts={}
+	out=open(outfile,'a')
+	if nproc == 1:
+		results=(fit_one(task) for task in tasks())
+		pool=None
+	else:
+		pool=multiprocessing.Pool(nproc,initializer=_init_worker)
+		results=pool.imap_unordered(fit_one,tasks())
+	try:
+		for result in results:
+			ahead.release()
+			out.write(json.dumps(result)+'\n')
+			out.flush()
+			counts[result['status']]=counts.get(result['status'],0)+1
+	finally:
+		out.close()
+		if pool:
+			## unblock the task feeder so the pool can shut down
+			stop.append(True)
+			for i in range(len(grbs)):
+				ahead.release()
+			pool.terminate()
+			pool.join()
+
+	print(counts)
+
+	return counts
+
+def read_catalog_fits(file):
+
+	## read the records written by fit_catalog back into fit_params objects,
+	## including unconverged cstat fits (success False)
+
+	fits={}
+	for line in open(file):
+		r=json.loads(line)
+		if r['status'] not in ('ok','unconverged'):
+			continue
+		perror=np.array(r['perror'])
+		p=fit_lc.fit_params(r['model'],r['pnames'],np.array(r['par']),\
+			perror[:,0],perror[:,1],r['chisq'],r['dof'])
+		if 'success' in r:
+			p.success=r['success']
+			p.message=r['message']
+		fits[r['grb']]=p
+
+	return fits
+
+if __name__ == '__main__':
+
+	import argparse
+
+	parser=argparse.ArgumentParser(description='Fit all XRT light curves without interaction')
+	parser.add_argument('--dir',default=None,help='GRB data directory')
+	parser.add_argument('--out',default='lc_fits.jsonl',help='output JSON lines file')
+	parser.add_argument('--nproc',type=int,default=None,help='number of worker processes')
+	parser.add_argument('--timeout',type=float,default=300.,help='seconds allowed per burst')
+	parser.add_argument('--guess',choices=['auto','previous'],default='auto',\
+		help='initial conditions from the light curve or from the previous fit')
+	parser.add_argument('--stat',choices=['chisq','censored','cstat','logchisq'],default='chisq',\
+		help='fit statistic (cstat: Poisson statistic on the counts, logchisq: chisq of log rate)')
+	parser.add_argument('--solver',choices=['curve_fit','bounded'],default='curve_fit',\
+		help='unconstrained curve_fit or bounded least squares (chisq only)')
+	parser.add_argument('--nstarts',type=int,default=1,help='starting points per burst (multi-start)')
+	parser.add_argument('--errors',choices=['covar','mcmc','bootstrap'],default='covar',\
+		help='parameter errors from the covariance matrix, an MCMC sampler or bootstrap refits')
+	parser.add_argument('--nboot',type=int,default=200,help='number of bootstrap refits')
+	parser.add_argument('--boot-time',type=float,default=None,\
+		help='seconds allowed for the bootstrap refits of each burst')
+	parser.add_argument('grbs',nargs='*',help='only fit these GRBs')
+	args=parser.parse_args()
+	if (args.solver == 'bounded') and (args.stat != 'chisq'):
+		parser.error('--solver bounded only works with --stat chisq')
+	guess={'auto':auto_guess,'previous':previous_fit_guess}[args.guess]
+
+	grbdict,grbrec,grblist=fit_lc.load_data(dir=args.dir)
+	fit_catalog(grbdict,args.out,nproc=args.nproc,timeout=args.timeout,guess=guess,\
+		grbs=args.grbs or None,stat=args.stat,errors=args.errors,\
+		nboot=args.nboot,boot_time=args.boot_time,solver=args.solver,nstarts=args.nstarts)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------------------------------
+
+Micro-benchmark of the light curve model kernels (fit_functions)
+
+Times one evaluation of each model, its bin-integrated version and their
+jacobians on a synthetic light curve, so the per-evaluation cost of the
+fitter's inner loop can be tracked from run to run.
+
+python bench_models.py
+python bench_models.py --nbins 1000 --out bench_models.jsonl
+python bench_models.py --grid    (bins precomputed in an lc_grid, as fit_lc does)
+
+------------------------------------------------------------------------
+"""
+
+import numpy as np
+import json
+import sys
+import time
+import timeit
+import fit_functions
+
+## model name -> parameters (continuum first, then each flare)
+bench_models={
+	'pow': [1e4,1.2],
+	'bkn2pow': [1e4,0.5,1e3,1.5,1e5,2.2],
+	'bkn4pow': [1e4,3.,2e2,0.5,1e3,1.2,1e4,1.8,1e5,2.5],
+	'gauss1': [50.,300.,40.],
+	'gauss3_bkn2pow': [1e4,0.5,1e3,1.5,1e5,2.2,50.,300.,40.,20.,2e3,300.,5.,1e4,2e3],
+	'norris1': [50.,200.,2e3,40.],
+	'norris3_bkn2pow': [1e4,0.5,1e3,1.5,1e5,2.2,50.,200.,2e3,40.,20.,1e3,5e4,200.,\
+		5.,5e3,1e5,2e3],
+}
+
+def bench_data(nbins=1000,tmin=30.,tmax=1e6):
+
+	## log-spaced contiguous bins like a rebinned XRT light curve
+	## returns bin centers t and edges xx=[tstart,tstop]
+
+	e=np.logspace(np.log10(tmin),np.log10(tmax),nbins+1)
+	xx=np.vstack((e[:-1],e[1:]))
+	t=np.sqrt(xx[0,:]*xx[1,:])
+
+	return t,xx
+
+def time_call(func,number=None,repeat=5):
+
+	## best time of one call in seconds, number of calls chosen to fill ~0.1 s
+
+	if number is None:
+		t=timeit.timeit(func,number=1)
+		number=max(int(0.1/max(t,1e-7)),1)
+	return min(timeit.repeat(func,number=number,repeat=repeat))/number
+
+def bench(nbins=1000,models=None,jac=True,grid=False):
+
+	## time every model in models (default bench_models) on nbins bins
+	## grid - evaluate on a fit_functions.lc_grid instead of the arrays
+	## returns {model: {'model','intmodel','jac','intjac'}} in microseconds
+
+	if models is None:
+		models=sorted(bench_models.keys())
+	t,xx=bench_data(nbins)
+	if grid:
+		xx=fit_functions.lc_grid(xx)
+		t=xx
+
+	results={}
+	print('%-20s %10s %10s %10s %10s   (us per call, %d bins)' % \
+		('model','point','integr','jac','int jac',nbins))
+	for name in models:
+		p=bench_models[name]
+		f=fit_functions.build_model(name)
+		intf=fit_functions.build_model('int'+name)
+		r={'model':1e6*time_call(lambda: f(t,*p)),
+			'intmodel':1e6*time_call(lambda: intf(xx,*p))}
+		if jac:
+			r['jac']=1e6*time_call(lambda: f.jac(t,*p))
+			r['intjac']=1e6*time_call(lambda: intf.jac(xx,*p))
+		results[name]=r
+		print('%-20s %10.1f %10.1f %10s %10s' % (name,r['model'],r['intmodel'],\
+			'%.1f' % r['jac'] if jac else '-','%.1f' % r['intjac'] if jac else '-'))
+
+	return results
+
+if __name__ == '__main__':
+
+	import argparse
+
+	parser=argparse.ArgumentParser(description='Time the light curve model kernels')
+	parser.add_argument('--nbins',type=int,default=1000,help='number of light curve bins')
+	parser.add_argument('--nojac',action='store_true',help='do not time the jacobians')
+	parser.add_argument('--grid',action='store_true',help='evaluate on a precomputed lc_grid')
+	parser.add_argument('--out',default=None,help='append the timings as a JSON line to this file')
+	parser.add_argument('models',nargs='*',help='only time these models')
+	args=parser.parse_args()
+
+	results=bench(nbins=args.nbins,models=args.models or None,jac=not args.nojac,grid=args.grid)
+	if args.out:
+		out=open(args.out,'a')
+		out.write(json.dumps({'time':time.time(),'nbins':args.nbins,'grid':args.grid,'numpy':np.__version__,\
+			'python':sys.version.split()[0],'results':results})+'\n')
+		out.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------------------------------
+
+Benchmark of the single pass qdp reader (fit_lc.read_qdp/read_lc)
+against the previous astropy ascii.read + Table.add_row + join path
+
+python bench_qdp.py /Users/jracusin/GRBs/
+
+------------------------------------------------------------------------
+"""
+
+import numpy as np
+from astropy.io import ascii
+from astropy.table import Table,Column,join
+import os
+import sys
+import time
+import fit_lc
+
+def read_curve_astropy(file):
+
+	## previous read_curve: WTSLEW section of curve.qdp one row at a time
+
+	f=open(file,'r')
+	lines=f.readlines()
+	header=[]
+	start=0
+	for line in lines:
+		tmp=line.split()
+		if len(tmp) >0:
+			if (tmp[1] == 'WTSLEW') & (not header):
+				start=1
+				continue
+			if (tmp[1] == 'NO'):
+				break
+			if (start == 1) & (not header):
+				header=tmp
+				d=Table(names=header)
+				continue
+			if (start == 1) & (len(header)>0):
+				d.add_row(tmp)
+
+	f.close()
+
+	return d
+
+def read_lc_astropy(dir=''):
+
+	## previous read_lc: ascii.read of each file and outer joins
+
+	files=fit_lc.lc_files
+	type=fit_lc.lc_types
+	start=0
+	itworked=False
+	for f in range(len(files)):
+		if os.path.isfile(dir+files[f]):
+			if f<=3:
+				data=ascii.read(dir+files[f],header_start=2,data_start=3)
+				if len(data[0]) >16:
+					del data['SYS_NEG','SYS_POS']
+				data.add_column(Column(np.repeat(type[f],len(data)),name='Type'))
+				if start==0:
+					d=data
+					start=1
+				else:
+					d=join(d,data,join_type='outer')
+			if f==4:
+				if 'WTSLEW' in open(dir+files[f]).read():
+					data=read_curve_astropy(dir+files[f])
+					data.add_column(Column(np.repeat(type[f],len(data)),name='Type'))
+					d=join(d,data,join_type='outer')
+			itworked=True
+
+	if itworked:
+		d.rename_column('!Time','Time')
+	else: d=0
+
+	return d
+
+def bench(dir,grbs=None,check=True):
+
+	## time both readers on every GRB directory under dir
+	## returns (seconds astropy, seconds new, number of light curves)
+
+	if grbs is None:
+		grbs=sorted([g for g in os.listdir(dir) if os.path.isdir(dir+g)])
+
+	told=0.
+	tnew=0.
+	n=0
+	for grb in grbs:
+		gdir=dir+grb+'/'
+		t0=time.time()
+		try:
+			old=read_lc_astropy(gdir)
+		except Exception:
+			continue
+		t1=time.time()
+		new=fit_lc.read_lc(gdir,cache=False)
+		t2=time.time()
+		if not old:
+			continue
+		told=told+t1-t0
+		tnew=tnew+t2-t1
+		n=n+1
+		if check:
+			a=np.sort(np.array(old['Time'],dtype=float))
+			b=np.array(new['Time'])
+			if (len(a) != len(b)) or (not np.allclose(a,b)):
+				print('Mismatch in '+grb)
+
+	print(str(n)+' light curves')
+	print('astropy ascii.read + join: %8.2f s (%6.1f ms per GRB)' % (told,1e3*told/max(n,1)))
+	print('fit_lc.read_qdp:           %8.2f s (%6.1f ms per GRB)' % (tnew,1e3*tnew/max(n,1)))
+	print('speedup: %.1fx' % (told/max(tnew,1e-9)))
+
+	return told,tnew,n
+
+if __name__ == '__main__':
+
+	if len(sys.argv) > 1:
+		dir=sys.argv[1]
+	else:
+		dir='/Users/jracusin/GRBs/'
+	if dir[-1] != '/':
+		dir=dir+'/'
+	bench(dir)
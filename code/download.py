@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------------------------------
+
+Concurrent, resumable file downloads for the Swift XRT products
+
+A bounded pool of threads, each holding persistent HTTP connections,
+fetches (url, file) jobs with retries and exponential backoff. Files are
+written to a temporary name and renamed into place, and every finished
+job is appended to a journal so an interrupted sync carries on where it
+stopped.
+
+------------------------------------------------------------------------
+"""
+
+import os
+import threading
+import time
+
+try:
+	import http.client as httplib
+	from urllib.parse import urlsplit,urljoin
+	import queue
+except ImportError:
+	import httplib
+	from urlparse import urlsplit,urljoin
+	import Queue as queue
+
+base_url='http://www.swift.ac.uk/'
+
+class DownloadError(Exception):
+	pass
+
+class connection_pool:
+
+	## persistent HTTP(S) connections for one thread, one per host
+
+	def __init__(self,timeout=60.):
+		self.timeout=timeout
+		self.conns={}
+
+	def get(self,url,maxredirect=5):
+
+		## GET url, following redirects. Returns (status, body)
+
+		for i in range(maxredirect+1):
+			parts=urlsplit(url)
+			key=(parts.scheme,parts.netloc)
+			conn=self.conns.get(key)
+			if conn is None:
+				if parts.scheme == 'https':
+					conn=httplib.HTTPSConnection(parts.netloc,timeout=self.timeout)
+				else:
+					conn=httplib.HTTPConnection(parts.netloc,timeout=self.timeout)
+				self.conns[key]=conn
+			path=parts.path or '/'
+			if parts.query:
+				path=path+'?'+parts.query
+			try:
+				conn.request('GET',path)
+				r=conn.getresponse()
+				body=r.read()
+			except Exception:
+				self.close(key)
+				raise
+			if r.status in (301,302,303,307,308):
+				url=urljoin(url,r.getheader('Location'))
+				continue
+			return r.status,body
+
+		raise DownloadError('Too many redirects: '+url)
+
+	def close(self,key=None):
+		if key is None:
+			keys=list(self.conns.keys())
+		else:
+			keys=[key]
+		for k in keys:
+			conn=self.conns.pop(k,None)
+			if conn is not None:
+				conn.close()
+
+def read_journal(journal):
+
+	## {file: status} of jobs already finished by an earlier (interrupted) run
+
+	done={}
+	if journal and os.path.exists(journal):
+		for line in open(journal):
+			tmp=line.rstrip('\n').split('\t')
+			if len(tmp) == 2:
+				done[tmp[1]]=tmp[0]
+
+	return done
+
+def fetch_one(pool,url,file,retries=4,backoff=1.):
+
+	## download url to file through pool, atomically
+	## returns 'ok' or 'missing' (404 or Swift's '404 page not found' page)
+	## raises DownloadError after retries failed attempts
+
+	for attempt in range(retries+1):
+		try:
+			status,body=pool.get(url)
+		except Exception as e:
+			status,body=None,str(e)
+		if status == 404:
+			return 'missing'
+		if status == 200:
+			if b'404 page not found' in body:
+				return 'missing'
+			tmp=file+'.part'
+			f=open(tmp,'wb')
+			f.write(body)
+			f.close()
+			os.rename(tmp,file)
+			return 'ok'
+		if (status is not None) and (status < 500) and (status != 429):
+			break
+		if attempt < retries:
+			time.sleep(backoff*2**attempt)
+
+	raise DownloadError(url+' failed: '+str(status))
+
+def fetch_files(jobs,nthreads=8,retries=4,backoff=1.,timeout=60.,journal=None,verbose=True):
+
+	## download a list of (url, file) jobs on nthreads threads
+	## journal - file recording finished jobs. Jobs already in it are skipped,
+	## so rerunning an interrupted sync resumes it. Removed once every job
+	## has finished.
+	## returns {file: 'ok' | 'missing' | 'failed' | 'skipped'}
+
+	done=read_journal(journal)
+	results={}
+	q=queue.Queue()
+	for url,file in jobs:
+		if (file in done) and ((done[file] == 'missing') or os.path.exists(file)):
+			results[file]='skipped'
+		else:
+			q.put((url,file))
+
+	lock=threading.Lock()
+	if journal:
+		fj=open(journal,'a')
+
+	def worker():
+		pool=connection_pool(timeout=timeout)
+		while True:
+			try:
+				url,file=q.get_nowait()
+			except queue.Empty:
+				break
+			try:
+				status=fetch_one(pool,url,file,retries=retries,backoff=backoff)
+			except Exception as e:
+				status='failed'
+				if verbose:
+					print(str(e))
+			with lock:
+				results[file]=status
+				if journal and (status != 'failed'):
+					fj.write(status+'\t'+file+'\n')
+					fj.flush()
+				if verbose and (status == 'ok'):
+					print('downloaded: '+url)
+		pool.close()
+
+	threads=[threading.Thread(target=worker) for i in range(max(min(nthreads,q.qsize()),1))]
+	for t in threads:
+		t.daemon=True
+		t.start()
+	for t in threads:
+		while t.is_alive():
+			t.join(0.5)
+
+	if journal:
+		fj.close()
+		if 'failed' not in results.values():
+			os.remove(journal)
+
+	return results
@@ -9,609 +9,1213 @@ x & xx must be np.array with xx.transpose()
 """
 
 import numpy as np
-import importlib
+import re
+from scipy.special import erf,erfcx,logsumexp
 
 def call_function(function,x,*p):
 
-	mod=importlib.import_module('fit_functions')
-	func=getattr(mod,function)
+	## model function (a function of this module or a model name for
+	## build_model) at x for parameters p, or for many parameter sets at
+	## once when p is a single (nsets,npar) array: returns (nsets,len(x))
+
+	if (len(p) == 1) and (np.ndim(p[0]) == 2):
+		try:
+			return evaluate(build_model(function),x,p[0])
+		except ValueError:
+			return np.array([call_function(function,x,*q) for q in p[0]])
+	if function in globals():
+		func=globals()[function]
+	else:
+		func=build_model(function)
 	yfit=func(x,*p)
 	
 	return yfit
 
-def logmean(x):
-
-	m=10**((np.log10(x[0,:])+np.log10(x[1,:]))/2)+np.min(x)
-
-	return m
+## memory (bytes) for the temporaries of one chunk of evaluate, small
+## enough for them to stay in cache
+batch_memory=2**22
 
-def pow(x,*p):
+def evaluate(f,x,p,chunk=None,log=False):
 
-	print p
-	norm=p[0]
-	pow1=p[1]
+	## model f (from build_model) for many parameter sets p (nsets,npar)
+	## at once: returns (nsets,nbins). The sets are broadcast through
+	## f.batch chunk at a time, by default as many as fit in batch_memory.
+	## x may be an lc_grid (its buffers are not used).
+	## log - the log of the model (f.logbatch)
 
-	f=norm*(x)**(-pow1)
+	p=np.atleast_2d(np.asarray(p,dtype=float))
+	if f.integrated:
+		n=len(_edges(x)[0])
+	else:
+		n=len(_points(x))
+	if chunk is None:
+		chunk=max(int(batch_memory//(8*n*f.width)),1)
 
-	return f
+	y=np.empty((len(p),n))
+	for i in range(0,len(p),chunk):
+		if log:
+			y[i:i+chunk]=f.logbatch(x,p[i:i+chunk])
+		else:
+			f.batch(x,p[i:i+chunk],out=y[i:i+chunk])
 
-def bknpow(x,*p):
+	return y
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
+def logmean(x):
 
-	#f=np.zeros(len(x))
-	#f[x<break1]=norm*x[x<break1]**(-pow1)
-	#f[x>=break1]=norm*break1**(pow2-pow1)*x[x>=break1]**(-pow2)
+	m=np.sqrt(x[0,:]*x[1,:])
 
-	f1=np.array([norm*x[x<break1]**(-pow1)])
-	f2=np.array([norm*break1**(pow2-pow1)*x[x>=break1]**(-pow2)])
-	f=np.append(f1,f2)
+	return m
 
-	return f
+class lc_grid:
 
-def bkn2pow(x,*p):
+	## the bins of a light curve, precomputed once per fit for every model
+	## evaluation: contiguous float64 edges x0 & x1 (rows of xx), widths,
+	## bin times t (logmean unless given) and the logs of t, x0 & x1.
+	## Models take it in place of x (point models use t) or xx. Models
+	## evaluated on a grid return one of its buffers, overwritten by the
+	## next evaluation of the same model on the grid (copy it to keep it).
+	## Only the outputs are reused: the kernels still allocate their
+	## intermediate arrays (segments, logs, erf terms, ...) on every call,
+	## several times the size of the output.
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
-	break2=p[4]
-	pow3=p[5]
+	def __init__(self,xx,t=None):
+		self.xx=np.ascontiguousarray(xx,dtype=float)
+		self.x0=self.xx[0]
+		self.x1=self.xx[1]
+		self.width=self.x1-self.x0
+		if t is None:
+			t=logmean(self.xx)
+		self.t=np.ascontiguousarray(t,dtype=float)
+		with np.errstate(divide='ignore',invalid='ignore'):
+			self.logt=np.log(self.t)
+			self.log0=np.log(self.x0)
+			self.log1=np.log(self.x1)
+		self.n=len(self.t)
+		self.buffers={}
 
-	f=np.zeros(len(x))
-	f[x<break1]=norm*x[x<break1]**(-pow1)
-	f[(x>=break1)&(x<break2)]=norm*break1**(pow2-pow1)*x[(x>=break1)&(x<break2)]**(-pow2)
-	f[x>=break2]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)*x[x>=break2]**(-pow3)
+	def __len__(self):
+		return self.n
 
-	return f
+	def __getitem__(self,i):
+		return self.xx[i]
 
-def bkn3pow(x,*p):
+	def buffer(self,key,ncol=None):
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
-	break2=p[4]
-	pow3=p[5]
-	break3=p[6]
-	pow4=p[7]
-
-	f=np.zeros(len(x))
-	f[x<break1]=norm*x[x<break1]**(-pow1)
-	f[(x>=break1)&(x<break2)]=norm*break1**(pow2-pow1)*x[(x>=break1)&(x<break2)]**(-pow2)
-	f[(x>=break2)&(x<break3)]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)* \
-		x[(x>=break2)&(x<break3)]**(-pow3)
-	f[x>=break3]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)*break3**(pow4-pow3)* \
-		x[x>=break3]**(-pow4)
+		## output array of n (or n x ncol) values kept under key
 
-	return f
+		shape=(self.n,) if ncol is None else (self.n,ncol)
+		b=self.buffers.get(key)
+		if (b is None) or (b.shape != shape):
+			b=np.empty(shape)
+			self.buffers[key]=b
 
+		return b
 
-def bkn4pow(x,*p):
+def _points(x):
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
-	break2=p[4]
-	pow3=p[5]
-	break3=p[6]
-	pow4=p[7]
-	break4=p[8]
-	pow5=p[9]
-
-	f=np.zeros(len(x))
-	f[x<break1]=norm*x[x<break1]**(-pow1)
-	f[(x>=break1)&(x<break2)]=norm*break1**(pow2-pow1)*x[(x>=break1)&(x<break2)]**(-pow2)
-	f[(x>=break2)&(x<break3)]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)* \
-		x[(x>=break2)&(x<break3)]**(-pow3)
-	f[(x>=break3)&(x<break4)]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)*break3**(pow4-pow3)* \
-		x[(x>=break3)&(x<break4)]**(-pow4)
-	f[x>=break4]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)*break3**(pow4-pow3)*break4**(pow5-pow4)* \
-		x[x>=break4]**(-pow5)
+	## times of points x or of the bins of an lc_grid
 
-	return f
+	if isinstance(x,lc_grid):
+		return x.t
+	return np.asarray(x,dtype=float)
 
-def gauss(x,*p):
+def _edges(xx):
 
-	norm=p[0]
-	center=p[1]
-	width=p[2]
+	## lower & upper edges and widths of bins xx or of an lc_grid
 
-	f=norm*exp(-(t-center)^2/(2*width^2))
+	if isinstance(xx,lc_grid):
+		return xx.x0,xx.x1,xx.width
+	xx=np.asarray(xx,dtype=float)
+	return xx[0,:],xx[1,:],xx[1,:]-xx[0,:]
 
-	return f
+def _logedges(xx):
 
-def gauss1_pow(x,*p):
+	## logs of the bin edges of xx or of an lc_grid
 
-	f=gauss(x,p[2:5])+intpow(x,p[0:2])
+	if isinstance(xx,lc_grid):
+		return xx.log0,xx.log1
+	xx=np.asarray(xx,dtype=float)
+	return np.log(xx[0,:]),np.log(xx[1,:])
 
-	return f
+def pow(x,*p):
 
-def gauss2_pow(x,*p):
+	norm=p[0]
+	pow1=p[1]
 
-	f=gauss(x,p[2:5])+gauss(x,p[5:8])+pow(x,p[0:2])
+	f=norm*_points(x)**(-pow1)
 
 	return f
 
-def gauss3_pow(x,*p):
+def nbknpow(x,*p):
 
-	f=gauss(x,p[2:5])+gauss(x,p[5:8])+gauss(x,p[8:11])+pow(x,p[0:2])
+	## broken power law with any number of breaks
+	## p = norm, pow1, break1, pow2, break2, pow3, ... breakN, powN+1
 
-	return f
+	return powerlaw(x,np.asarray(p,dtype=float))
 
-def gauss4_pow(x,*p):
+def _take(a,i):
 
-	f=gauss(x,p[2:5])+gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+pow(x,p[0:2])
+	## a[...,i] for per parameter set indices i
 
-	return f
+	if a.ndim == 1:
+		return a[i]
+	return np.take_along_axis(a,i,axis=-1)
 
-def gauss5_pow(x,*p):
+def _segments(x,breaks):
 
-	f=gauss(x,p[2:5])+gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+pow(x,p[0:2])
+	## segment of each x, the number of breaks <= x (so x>=breakN belongs
+	## to the next segment), for each set of breaks along the leading axes.
+	## The same for one or many sets even if a fit left the breaks unsorted.
 
-	return f
+	if breaks.ndim == 1:
+		return np.searchsorted(np.sort(breaks),x,side='right')
+	return np.sum(x[...,np.newaxis] >= breaks[...,np.newaxis,:],axis=-1)
 
-def gauss6_pow(x,*p):
+def _lognorm(pows,breaks):
 
-	f=gauss(x,p[2:5])+gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])\
-		+gauss(x,p[17:20])+pow(x,p[0:2])
+	## log segment normalizations (without norm) from a cumulative sum
 
-	return f
+	lognorm=np.zeros(pows.shape)
+	lognorm[...,1:]=np.cumsum(np.log(breaks)*np.diff(pows,axis=-1),axis=-1)
 
-def gauss1_bknpow(x,*p):
+	return lognorm
 
-	f=gauss(x,p[5:8])+bknpow(x,p[0:4])
+def powerlaw(x,p,out=None):
 
-	return f
+	## broken power law with any number of breaks for one or many parameter
+	## sets: p = norm, pow1, break1, ... powN+1 along the last axis, leading
+	## axes are independent sets and are kept in the result
+	## out - array for the result (one parameter set)
 
-def gauss2_bknpow(x,*p):
+	p=np.asarray(p,dtype=float)
+	norm=p[...,0,np.newaxis] if p.ndim > 1 else p[0]
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+bknpow(x,p[0:4])
+	f=np.exp(_powerlaw_exponent(x,p),out=out)
+	f*=norm
 
 	return f
 
-def gauss3_bknpow(x,*p):
+def _powerlaw_exponent(x,p):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+bknpow(x,p[0:4])
-
-	return f
+	## log(powerlaw/norm): the segment's log normalization - pow*log(x)
 
-def gauss4_bknpow(x,*p):
+	pows=p[...,1::2]
+	breaks=p[...,2::2]
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+bknpow(x,p[0:4])
+	if isinstance(x,lc_grid):
+		logx=x.logt
+		x=x.t
+	else:
+		x=np.asarray(x,dtype=float)
+		logx=np.log(x)
+	seg=_segments(x,breaks)
 
-	return f
+	return _take(_lognorm(pows,breaks),seg)-_take(pows,seg)*logx
 
-def gauss5_bknpow(x,*p):
+def logpowerlaw(x,p):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+gauss(x,p[17:20])\
-		+bknpow(x,p[0:4])
+	## log of the broken power law, log(norm) - pow*log(x) plus the
+	## cumulative break offsets, finite however steep the decay
 
-	return f
+	p=np.asarray(p,dtype=float)
+	lognorm=np.log(p[...,0,np.newaxis] if p.ndim > 1 else p[0])
 
-def gauss6_bknpow(x,*p):
+	return lognorm+_powerlaw_exponent(x,p)
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+gauss(x,p[17:20])\
-		+gauss(x,p[20:23])+bknpow(x,p[0:4])
+def bknpow(x,*p):
 
-	return f
+	return nbknpow(x,*p[0:4])
 
-def gauss1_bkn2pow(x,*p):
+def bkn2pow(x,*p):
 
-	f=gauss(x,p[7:10])+bkn2pow(x,p[0:6])
+	return nbknpow(x,*p[0:6])
 
-	return f
+def bkn3pow(x,*p):
 
-def gauss2_bkn2pow(x,*p):
+	return nbknpow(x,*p[0:8])
 
-	f=gauss(x,p[7:10])+gauss(x,p[10:13])+bkn2pow(x,p[0:6])
+def bkn4pow(x,*p):
 
-	return f
+	return nbknpow(x,*p[0:10])
 
-def gauss3_bkn2pow(x,*p):
+def gauss(x,*p):
 
-	f=gauss(x,p[7:10])+gauss(x,p[10:13])+gauss(x,p[13:16])+bkn2pow(x,p[0:6])
+	f=gauss_pulses(x,np.asarray(p[0:3],dtype=float))
 
 	return f
 
-def gauss4_bkn2pow(x,*p):
+def gauss_pulses(x,p,out=None):
 
-	f=gauss(x,p[7:10])+gauss(x,p[10:13])+gauss(x,p[13:16])+gauss(x,p[16:19])+bkn2pow(x,p[0:6])
-
-	return f
+	## sum of p.shape[-1]/3 gaussians evaluated in one broadcast
+	## p = norm1, center1, width1, norm2, center2, width2, ...
+	## leading axes of p are independent parameter sets
 
-def gauss5_bkn2pow(x,*p):
+	x=_points(x)
+	p=np.asarray(p,dtype=float)
+	p=p.reshape(p.shape[:-1]+(-1,3,1))
+	norm=p[...,0,:]
+	center=p[...,1,:]
+	width=p[...,2,:]
 
-	f=gauss(x,p[7:10])+gauss(x,p[10:13])+gauss(x,p[13:16])+gauss(x,p[16:19])+gauss(x,p[19:22])\
-		+bkn2pow(x,p[0:6])
+	f=norm*np.exp(-(x-center)**2/(2.*width**2))
 
-	return f
+	return np.sum(f,axis=-2,out=out)
 
-def gauss6_bkn2pow(x,*p):
+def norris(x,*p):
 
-	f=gauss(x,p[7:10])+gauss(x,p[10:13])+gauss(x,p[13:16])+gauss(x,p[16:19])+gauss(x,p[19:22])\
-		+gauss(x,p[22:25])+bkn2pow(x,p[0:6])
+	f=norris_pulses(x,np.asarray(p[0:4],dtype=float))
 
 	return f
 
-def gauss1_bkn3pow(x,*p):
+def norris_pulses(x,p,out=None):
 
-	f=gauss(x,p[5:8])+bkn3pow(x,p[0:6])
+	## sum of len(p)/4 Norris et al. (2005) pulses in one broadcast
+	## f = norm*exp(2*sqrt(rise/decay))*exp(-rise/(t-start)-(t-start)/decay)
+	## for t>start, so norm is the peak rate at t=start+sqrt(rise*decay)
+	## p = norm1, start1, rise1, decay1, norm2, ...
+	## leading axes of p are independent parameter sets
 
-	return f
+	x=_points(x)
+	p=np.asarray(p,dtype=float)
+	p=p.reshape(p.shape[:-1]+(-1,4,1))
+	norm=p[...,0,:]
+	start=p[...,1,:]
+	rise=p[...,2,:]
+	decay=p[...,3,:]
 
-def gauss2_bkn3pow(x,*p):
+	u=x-start
+	up=np.where(u > 0,u,1.)
+	f=np.where(u > 0,norm*np.exp(2*np.sqrt(rise/decay)-rise/up-up/decay),0.)
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+bkn3pow(x,p[0:6])
+	return np.sum(f,axis=-2,out=out)
 
-	return f
+def loggauss_pulses(x,p):
 
-def gauss3_bkn3pow(x,*p):
+	## log of gauss_pulses, the pulses combined with a log-sum-exp
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+bkn3pow(x,p[0:6])
+	x=_points(x)
+	p=np.asarray(p,dtype=float)
+	p=p.reshape(p.shape[:-1]+(-1,3,1))
 
-	return f
+	with np.errstate(divide='ignore'):
+		return logsumexp(-(x-p[...,1,:])**2/(2.*p[...,2,:]**2),b=p[...,0,:],axis=-2)
 
-def gauss4_bkn3pow(x,*p):
+def lognorris_pulses(x,p):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+bkn3pow(x,p[0:6])
+	## log of norris_pulses, the pulses combined with a log-sum-exp
 
-	return f
+	x=_points(x)
+	p=np.asarray(p,dtype=float)
+	p=p.reshape(p.shape[:-1]+(-1,4,1))
+	rise=p[...,2,:]
+	decay=p[...,3,:]
 
-def gauss5_bkn3pow(x,*p):
+	u=x-p[...,1,:]
+	up=np.where(u > 0,u,1.)
+	g=np.where(u > 0,2*np.sqrt(rise/decay)-rise/up-up/decay,-np.inf)
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+gauss(x,p[17:20])\
-		+bkn3pow(x,p[0:6])
+	with np.errstate(divide='ignore'):
+		return logsumexp(g,b=p[...,0,:],axis=-2)
 
-	return f
+############ INTEGRAL VERSIONS
 
-def gauss6_bkn3pow(x,*p):
+def intpow(xx,*p):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+gauss(x,p[17:20])\
-		+gauss(x,p[20:23])+bkn3pow(x,p[0:6])
+	return intnbknpow(xx,*p[0:2])
 
-	return f
+def _bkn_bins(x0,x1,breaks,bounds=None):
 
-def gauss1_bkn4pow(x,*p):
+	## split each bin [x0,x1] at the breaks it straddles
+	## returns the segments s0, s1 of x0 & x1, the bounds of the first piece
+	## (x0 to x1 or the next break) and the last piece (the break before x1
+	## to x1, only used where s1>s0). Whole segments in between come from
+	## cumulative sums. Leading axes of breaks are independent sets.
+	## bounds - (l0,l1,logbreaks) to return the pieces' bounds in log instead
 
-	f=gauss(x,p[5:8])+bkn4pow(x,p[0:8])
+	s0=_segments(x0,breaks)
+	s1=_segments(x1,breaks)
+	if bounds is not None:
+		x0,x1,breaks=bounds
+	edge=np.ones(breaks.shape[:-1]+(1,))
+	hi=_take(np.concatenate((breaks,np.inf*edge),axis=-1),s0)
+	lo=_take(np.concatenate((-np.inf*edge if bounds else 0.*edge,breaks),axis=-1),s1)
+	first=(x0,np.minimum(x1,hi))
+	last=(np.maximum(x0,lo),x1)
 
-	return f
+	return s0,s1,first,last
 
-def gauss2_bkn4pow(x,*p):
+def intnbknpow(xx,*p):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+bkn4pow(x,p[0:8])
+	## bin-averaged broken power law with any number of breaks
+	## p = norm, pow1, break1, pow2, ... breakN, powN+1
 
-	return f
+	return intpowerlaw(xx,np.asarray(p,dtype=float))
 
-def gauss3_bkn4pow(x,*p):
+def _powint(n,a,lu,lv):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+bkn4pow(x,p[0:8])
+	## integral of n*x**(a-1) from exp(lu) to exp(lv), written as
+	## n*exp(a*lu)*expm1(a*(lv-lu))/a so that it has no cancellation near
+	## pow=1, as _logpowint. a must be _nonzero.
 
-	return f
+	return n*np.exp(a*lu)*np.expm1(a*(lv-lu))/a
 
-def gauss4_bkn4pow(x,*p):
+def _nonzero(a):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+bkn4pow(x,p[0:8])
+	## a with zeros replaced by a value so small that expm1(a*d)/a = d
+	## exactly, the a->0 limit of _powint
 
-	return f
+	return np.where(a != 0,a,1e-200)
 
-def gauss5_bkn4pow(x,*p):
+def intpowerlaw(xx,p,out=None):
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+gauss(x,p[17:20])\
-		+bkn4pow(x,p[0:8])
+	## bin-averaged broken power law (parameter sets as in powerlaw)
+	## bins straddling breaks are split there and the analytic integrals
+	## of the pieces summed, so the bin average is exact
+	## out - array for the result (one parameter set)
 
-	return f
+	p=np.asarray(p,dtype=float)
+	norm=p[...,0,np.newaxis] if p.ndim > 1 else p[0]
+	pows=p[...,1::2]
+	breaks=p[...,2::2]
 
-def gauss6_bkn4pow(x,*p):
+	x0,x1,width=_edges(xx)
+	l0,l1=_logedges(xx)
+	logb=np.log(breaks)
+	s0,s1,first,last=_bkn_bins(x0,x1,breaks,bounds=(l0,l1,logb))
+	n=norm*np.exp(_lognorm(pows,breaks))
+	a=_nonzero(1.-pows)
 
-	f=gauss(x,p[5:8])+gauss(x,p[8:11])+gauss(x,p[11:14])+gauss(x,p[14:17])+gauss(x,p[17:20])\
-		+gauss(x,p[20:23])+bkn4pow(x,p[0:8])
+	## integrals of whole segments between breaks, cum[k] = sum of those before k
+	full=_powint(n[...,1:-1],a[...,1:-1],logb[...,:-1],logb[...,1:])
+	cum=np.concatenate((np.zeros(n.shape[:-1]+(2,)),np.cumsum(full,axis=-1)),axis=-1)
 
-	return f
+	f=_powint(_take(n,s0),_take(a,s0),first[0],first[1])
 
-############ INTEGRAL VERSIONS
+	split=s1 > s0
+	if np.any(split):
+		a1=_take(a,s1)[split]
+		n1=_take(n,s1)[split]
+		c=(_take(cum,s1)-_take(cum,np.minimum(s0+1,cum.shape[-1]-1)))[split]
+		u=np.broadcast_to(last[0],split.shape)[split]
+		v=np.broadcast_to(last[1],split.shape)[split]
+		f[split]+=_powint(n1,a1,u,v)+c
 
-def intpow(xx,*p):
+	return np.divide(f,width,out=out)
 
-	norm=p[0]
-	pow1=p[1]
+def _logpowint(logn,a,lu,lv):
 
-	f=norm/(1.-pow1)*(xx[1,:]**(1.-pow1)-xx[0,:]**(1.-pow1))
-	f=f/(xx[1,:]-xx[0,:])
+	## log of the integral of exp(logn)*x**(a-1) from exp(lu) to exp(lv),
+	## -inf for empty pieces
 
-	return f
+	with np.errstate(divide='ignore',invalid='ignore'):
+		d=lv-lu
+		x=np.abs(a)*d
+		r=np.where(x < np.log(2.),np.log(-np.expm1(-x)),np.log1p(-np.exp(-x)))
+		r=np.maximum(a*lu,a*lv)+r-np.log(np.abs(a))
+		return logn+np.where(a != 0,r,np.log(d))
 
-def intbknpow(xx,*p):
+def _logsubexp(a,b):
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
+	## log(exp(a)-exp(b)) for a >= b, -inf where they are equal
 
-	f=np.zeros(len(xx[0]))
-	m=logmean(xx)
+	with np.errstate(divide='ignore',invalid='ignore'):
+		return np.where(b < a,a+np.log1p(-np.exp(b-a)),-np.inf)
 
-	f[m<break1]=norm/(1.-pow1)*(xx[1,m<break1]**(1.-pow1)-xx[0,m<break1]**(1.-pow1))
-	f[m>=break1]=norm*break1**(pow2-pow1)/(1.-pow2)* \
-		(xx[1,m>=break1]**(1.-pow2)-xx[0,m>=break1]**(1.-pow2))
-	f=f/(xx[1,:]-xx[0,:])
+def logintpowerlaw(xx,p):
 
-	return f
+	## log of the bin-averaged broken power law (intpowerlaw), with the
+	## pieces of bins straddling breaks combined by log-sum-exp
 
-def intbkn2pow(xx,*p):
+	p=np.asarray(p,dtype=float)
+	lognorm=np.log(p[...,0,np.newaxis] if p.ndim > 1 else p[0])
+	pows=p[...,1::2]
+	breaks=p[...,2::2]
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
-	break2=p[4]
-	pow3=p[5]
+	x0,x1,width=_edges(xx)
+	l0,l1=_logedges(xx)
+	logb=np.log(breaks)
+	s0,s1,first,last=_bkn_bins(x0,x1,breaks,bounds=(l0,l1,logb))
+	logn=lognorm+_lognorm(pows,breaks)
+	a=1.-pows
 
-	f=np.zeros(len(xx[0]))
-	m=logmean(xx)
+	full=_logpowint(logn[...,1:-1],a[...,1:-1],logb[...,:-1],logb[...,1:])
+	cum=np.concatenate((np.zeros(logn.shape[:-1]+(2,))-np.inf,\
+		np.logaddexp.accumulate(full,axis=-1)),axis=-1)
 
-	f[m<break1]=norm/(1.-pow1)*(xx[1,m<break1]**(1.-pow1)-xx[0,m<break1]**(1.-pow1))
-	f[(m>=break1)&(m<break2)]=norm*break1**(pow2-pow1)/(1.-pow2)* \
-		(xx[1,(m>=break1)&(m<break2)]**(1.-pow2)-xx[0,(m>=break1)&(m<break2)]**(1.-pow2))
-	f[m>break2]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)/(1.-pow3)* \
-		(xx[1,m>break2]**(1-pow3)-xx[0,m>break2]**(1.-pow3))
-	f=f/(xx[1,:]-xx[0,:])
+	f=_logpowint(_take(logn,s0),_take(a,s0),first[0],first[1])
 
-	return f
+	split=s1 > s0
+	if np.any(split):
+		a1=_take(a,s1)[split]
+		n1=_take(logn,s1)[split]
+		c=_logsubexp(_take(cum,s1),_take(cum,np.minimum(s0+1,cum.shape[-1]-1)))[split]
+		u=np.broadcast_to(last[0],split.shape)[split]
+		v=np.broadcast_to(last[1],split.shape)[split]
+		f[split]=np.logaddexp(np.logaddexp(f[split],_logpowint(n1,a1,u,v)),c)
 
-def intbkn3pow(xx,*p):
+	return f-np.log(width)
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
-	break2=p[4]
-	pow3=p[5]
-	break3=p[6]
-	pow4=p[7]
-
-	f=np.zeros(len(xx[0]))
-	m=logmean(xx)
-
-	f[m<break1]=norm/(1.-pow1)*(xx[1,m<break1]**(1.-pow1)-xx[0,m<break1]**(1.-pow1))
-	f[(m>=break1)&(m<break2)]=norm*break1**(pow2-pow1)/(1.-pow2)* \
-		(xx[1,(m>=break1)&(m<break2)]**(1.-pow2)-xx[0,(m>=break1)&(m<break2)]**(1.-pow2))
-	f[(m>=break2)&(m<break3)]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)/(1.-pow3)* \
-		(xx[1,(m>=break2)&(m<break3)]**(1-pow3)-xx[0,(m>=break2)&(m<break3)]**(1.-pow3))
-	f[m>=break3]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)*break3**(pow4-pow3)/(1.-pow4)* \
-		(xx[1,m>=break3]**(1-pow4)-xx[0,m>=break3]**(1.-pow4))
-	f=f/(xx[1,:]-xx[0,:])
+def intbknpow(xx,*p):
 
-	return f
-	
-def intbkn4pow(xx,*p):
+	return intnbknpow(xx,*p[0:4])
 
-	norm=p[0]
-	pow1=p[1]
-	break1=p[2]
-	pow2=p[3]
-	break2=p[4]
-	pow3=p[5]
-	break3=p[6]
-	pow4=p[7]
-	break4=p[8]
-	pow5=p[9]
-
-	f=np.zeros(len(xx[0]))
-	m=logmean(xx)
-
-	f[m<break1]=norm/(1.-pow1)*(xx[1,m<break1]**(1.-pow1)-xx[0,m<break1]**(1.-pow1))
-	f[(m>=break1)&(m<break2)]=norm*break1**(pow2-pow1)/(1.-pow2)* \
-		(xx[1,(m>=break1)&(m<break2)]**(1.-pow2)-xx[0,(m>=break1)&(m<break2)]**(1.-pow2))
-	f[(m>=break2)&(m<break3)]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)/(1.-pow3)* \
-		(xx[1,(m>=break2)&(m<break3)]**(1-pow3)-xx[0,(m>=break2)&(m<break3)]**(1.-pow3))
-	f[(m>=break3)&(m<break4)]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)* \
-		break3**(pow4-pow3)/(1.-pow4)*(xx[1,(m>=break3)&(m<break4)]**(1-pow4)- \
-		xx[0,(m>=break3)&(m<break4)]**(1.-pow4))
-	f[m>=break4]=norm*break1**(pow2-pow1)*break2**(pow3-pow2)*break3**(pow4-pow3)* \
-		break4**(pow5-pow4)/(1.-pow4)* \
-		(xx[1,m>=break4]**(1-pow4)-xx[0,m>=break4]**(1.-pow4))
-	f=f/(xx[1,:]-xx[0,:])
+def intbkn2pow(xx,*p):
 
-	return f
+	return intnbknpow(xx,*p[0:6])
 
-def intgauss(xx,*p):
+def intbkn3pow(xx,*p):
 
-	f=sqrt(math.pi/2.)*(-p[0])*p[2]*(math.erf((p[1]-xx[1,:])/(sqrt(2)*p[2]))-math.erf((p[1]-xx[0,:])/(sqrt(2)*p[2])))
-	f=f/(xx[1,:]-xx[0,:])
+	return intnbknpow(xx,*p[0:8])
 	
-	return f
+def intbkn4pow(xx,*p):
 
-def intgauss1_pow(x,*p):
+	return intnbknpow(xx,*p[0:10])
 
-	f=intgauss(xx,p[2:5])+intpow(xx,p[0:2])
+def _erf_diff(a,b):
 
-	return f
+	## erf(b)-erf(a) without cancellation. When a & b are both beyond 0.5
+	## on the same side of 0 (the tails, where erf -> +-1) it is written with
+	## the scaled erfc, erfcx(x)=exp(x**2)*erfc(x), for |a|<|b|:
+	## exp(-a**2)*(erfcx(a)-erfcx(b)-erfcx(b)*expm1(a**2-b**2))
 
-def intgauss2_pow(xx,*p):
+	a=np.asarray(a,dtype=float)
+	b=np.asarray(b,dtype=float)
+	lo=np.minimum(a,b)
+	hi=np.maximum(a,b)
+	sign=np.where(b >= a,1.,-1.)
 
-	f=intgauss(xx,p[2:5])+intgauss(xx,p[5:8])+intpow(xx,p[0:2])
+	same=(lo >= 0.5) | (hi <= -0.5)
+	x0=np.where(same,np.where(hi < 0,-hi,lo),0.)
+	x1=np.where(same,np.where(hi < 0,-lo,hi),0.)
+	e0=erfcx(x0)
+	e1=erfcx(x1)
+	tail=np.exp(-x0**2)*((e0-e1)-e1*np.expm1((x0-x1)*(x0+x1)))
 
-	return f
+	return sign*np.where(same,tail,erf(hi)-erf(lo))
 
-def intgauss3_pow(xx,*p):
+def intgauss(xx,*p):
 
-	f=intgauss(xx,p[2:5])+intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intpow(xx,p[0:2])
+	f=intgauss_pulses(xx,np.asarray(p[0:3],dtype=float))
 
 	return f
 
-def intgauss4_pow(xx,*p):
+def intgauss_pulses(xx,p,out=None):
 
-	f=intgauss(xx,p[2:5])+intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intpow(xx,p[0:2])
-
-	return f
+	## bin-averaged sum of len(p)/3 gaussians evaluated in one broadcast
+	## stable for flares much narrower or much wider than the bins (_erf_diff)
 
-def intgauss5_pow(xx,*p):
+	x0,x1,dx=_edges(xx)
+	p=np.asarray(p,dtype=float)
+	p=p.reshape(p.shape[:-1]+(-1,3,1))
+	norm=p[...,0,:]
+	center=p[...,1,:]
+	width=p[...,2,:]
 
-	f=intgauss(xx,p[2:5])+intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intpow(xx,p[0:2])
+	s=np.sqrt(2.)*width
+	f=np.sqrt(np.pi/2.)*norm*width*_erf_diff((x0-center)/s,(x1-center)/s)
+	f=np.sum(f,axis=-2,out=out)
+	f/=dx
 
 	return f
 
-def intgauss6_pow(xx,*p):
+## Gauss-Legendre nodes & weights on [0,1] for the Norris bin integrals
+norris_nodes,norris_weights=np.polynomial.legendre.leggauss(24)
+norris_nodes=(norris_nodes+1.)/2.
+norris_weights=norris_weights/2.
+## pulses are integrated where they are above exp(-norris_cut) of the peak
+norris_cut=40.
 
-	f=intgauss(xx,p[2:5])+intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])\
-		+intgauss(xx,p[17:20])+intpow(xx,p[0:2])
+def _norris_quad(xx,p):
 
-	return f
+	## quadrature points of each pulse in each bin: Gauss-Legendre in log(t-start)
+	## over the part of the bin where the pulse is not negligible
+	## returns u=t-start (...,npulse,nbins,nnodes), weights*du and the pulse
+	## parameters (...,npulse,4,1,1)
 
-def intgauss1_bknpow(xx,*p):
+	x0,x1,dx=_edges(xx)
+	p=np.asarray(p,dtype=float)
+	p=p.reshape(p.shape[:-1]+(-1,4,1))
+	start=p[...,1,:]
+	rise=p[...,2,:]
+	decay=p[...,3,:]
 
-	f=intgauss(xx,p[5:8])+intbknpow(xx,p[0:4])
+	## exp(-k(z+1/z-2)) with z=u/sqrt(rise*decay), k=sqrt(rise/decay)
+	tau=np.sqrt(rise*decay)
+	q=2.+norris_cut/np.sqrt(rise/decay)
+	zlo=(q-np.sqrt(q**2-4.))/2.
+	lo=np.maximum(x0-start,tau*zlo)
+	hi=np.minimum(x1-start,tau/zlo)
+	empty=hi <= lo
+	lo=np.where(empty,1.,lo)
+	hi=np.where(empty,1.,hi)
 
-	return f
+	loglo=np.log(lo)[...,np.newaxis]
+	dlog=(np.log(hi)-np.log(lo))[...,np.newaxis]
+	u=np.exp(loglo+dlog*norris_nodes)
+	w=dlog*norris_weights*u
 
-def intgauss2_bknpow(xx,*p):
+	return u,w,p[...,np.newaxis]
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intbknpow(xx,p[0:4])
+def intnorris(xx,*p):
 
-	return f
+	f=intnorris_pulses(xx,np.asarray(p[0:4],dtype=float))
 
-def intgauss3_bknpow(xx,*p):
+	return f
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intbknpow(xx,p[0:4])
+def intnorris_pulses(xx,p,out=None):
 
-	return f
+	## bin-averaged sum of len(p)/4 Norris pulses, by quadrature in each bin
 
-def intgauss4_bknpow(xx,*p):
+	u,w,p=_norris_quad(xx,p)
+	norm=p[...,0,:,0]
+	rise=p[...,2,:,:]
+	decay=p[...,3,:,:]
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intbknpow(xx,p[0:4])
+	g=np.exp(2*np.sqrt(rise/decay)-rise/u-u/decay)
+	f=np.sum(norm*np.sum(w*g,axis=-1),axis=-2,out=out)
+	f/=_edges(xx)[2]
 
 	return f
 
-def intgauss5_bknpow(xx,*p):
+############ JACOBIANS
+## analytic derivatives df/dp, returned as (len(x),len(p)) arrays for curve_fit
+## out - array (or column slice of one) for the result
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intgauss(xx,p[17:20])\
-		+intbknpow(xx,p[0:4])
+def _bkn_lognorm(pows,breaks):
 
-	return f
+	## log segment normalizations L_k (without norm) and their derivatives
+	## dL_k/dpow_i (nseg x nseg) and dL_k/dbreak_j (nseg x nbreaks)
 
-def intgauss6_bknpow(xx,*p):
+	nseg=len(pows)
+	logb=np.log(breaks)
+	lognorm=np.zeros(nseg)
+	lognorm[1:]=np.cumsum(logb*np.diff(pows))
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intgauss(xx,p[17:20])\
-		+intgauss(xx,p[20:23])+intbknpow(xx,p[0:4])
+	dpow=np.tri(nseg)*np.hstack((0.,logb))-np.tri(nseg,k=-1)*np.hstack((logb,0.))
+	dbreak=np.tri(nseg,nseg-1,k=-1)*(np.diff(pows)/breaks)
 
-	return f
+	return lognorm,dpow,dbreak
 
-def intgauss1_bkn2pow(xx,*p):
+def nbknpow_jac(x,p,out=None):
 
-	f=intgauss(xx,p[7:10])+intbkn2pow(xx,p[0:6])
+	p=np.asarray(p,dtype=float)
+	norm=p[0]
+	pows=p[1::2]
+	breaks=p[2::2]
+
+	if isinstance(x,lc_grid):
+		logx=x.logt
+		x=x.t
+	else:
+		x=np.asarray(x,dtype=float)
+		logx=np.log(x)
+	seg=_segments(x,breaks)
+	lognorm,dpow,dbreak=_bkn_lognorm(pows,breaks)
+
+	u=np.exp(lognorm[seg]-pows[seg]*logx)
+	f=norm*u
+
+	j=np.empty((len(x),len(p))) if out is None else out
+	j[:,0]=u
+	j[:,1::2]=f[:,np.newaxis]*dpow[seg]
+	j[np.arange(len(x)),1+2*seg]-=f*logx
+	j[:,2::2]=f[:,np.newaxis]*dbreak[seg]
+
+	return j
+
+def _bkn_piece_jac(norm,lognorm,dpow,dbreak,pows,s,u,v,npar):
+
+	## integral of segment s from u to v and its derivatives. The bounds are
+	## held fixed: where they are breaks, the boundary terms of neighbouring
+	## pieces cancel because the broken power law is continuous.
+
+	## g & dg/da in the form of _powint, with the series of
+	## (d*exp(a*d)-expm1(a*d)/a)/a for small a*d
+	a=_nonzero(1.-pows)[s]
+	lu=np.log(u)
+	d=np.log(v)-lu
+	ad=a*d
+	em=np.expm1(ad)
+	e=em/a
+	h=np.where(abs(ad) < 1e-5,d**2*(0.5+ad/3.),(d*(em+1.)-e)/a)
+	ua=np.exp(a*lu)
+	g=ua*e
+	dgda=ua*(lu*e+h)
+
+	n=np.exp(lognorm[s])
+	f=norm*n*g
+
+	j=np.empty((len(u),npar))
+	j[:,0]=n*g
+	j[:,1::2]=f[:,np.newaxis]*dpow[s]
+	j[np.arange(len(u)),1+2*s]-=norm*n*dgda
+	j[:,2::2]=f[:,np.newaxis]*dbreak[s]
+
+	return f,j
+
+def intnbknpow_jac(xx,p,out=None):
+
+	p=np.asarray(p,dtype=float)
+	norm=p[0]
+	pows=p[1::2]
+	breaks=p[2::2]
+	nseg=len(pows)
 
-	return f
+	x0,x1,dx=_edges(xx)
+	s0,s1,first,last=_bkn_bins(x0,x1,breaks)
+	lognorm,dpow,dbreak=_bkn_lognorm(pows,breaks)
+	args=(norm,lognorm,dpow,dbreak,pows)
 
-def intgauss2_bkn2pow(xx,*p):
+	f,j=_bkn_piece_jac(*(args+(s0,first[0],first[1],len(p))))
 
-	f=intgauss(xx,p[7:10])+intgauss(xx,p[10:13])+intbkn2pow(xx,p[0:6])
+	split=s1>s0
+	if np.any(split):
+		fl,jl=_bkn_piece_jac(*(args+(s1[split],last[0][split],last[1][split],len(p))))
+		ff,jf=_bkn_piece_jac(*(args+(np.arange(1,nseg-1),breaks[:-1],breaks[1:],len(p))))
+		cum=np.vstack((np.zeros((2,len(p))),np.cumsum(jf,axis=0)))
+		j[split]+=jl+cum[s1[split]]-cum[s0[split]+1]
 
-	return f
+	return np.divide(j,dx[:,np.newaxis],out=out)
 
-def intgauss3_bkn2pow(xx,*p):
+def logpowerlaw_jac(x,p):
 
-	f=intgauss(xx,p[7:10])+intgauss(xx,p[10:13])+intgauss(xx,p[13:16])+intbkn2pow(xx,p[0:6])
+	## d log(f)/dp of the broken power law, without evaluating f
 
-	return f
+	p=np.asarray(p,dtype=float)
+	pows=p[1::2]
+	breaks=p[2::2]
 
-def intgauss4_bkn2pow(xx,*p):
+	if isinstance(x,lc_grid):
+		logx=x.logt
+		x=x.t
+	else:
+		x=np.asarray(x,dtype=float)
+		logx=np.log(x)
+	seg=_segments(x,breaks)
+	lognorm,dpow,dbreak=_bkn_lognorm(pows,breaks)
 
-	f=intgauss(xx,p[7:10])+intgauss(xx,p[10:13])+intgauss(xx,p[13:16])+intgauss(xx,p[16:19])+intbkn2pow(xx,p[0:6])
+	j=np.empty((len(x),len(p)))
+	j[:,0]=1./p[0]
+	j[:,1::2]=dpow[seg]
+	j[np.arange(len(x)),1+2*seg]-=logx
+	j[:,2::2]=dbreak[seg]
 
-	return f
+	return j
 
-def intgauss5_bkn2pow(xx,*p):
+def _logpulses_jac(logp,dlogp):
 
-	f=intgauss(xx,p[7:10])+intgauss(xx,p[10:13])+intgauss(xx,p[13:16])+intgauss(xx,p[16:19])+intgauss(xx,p[19:22])\
-		+intbkn2pow(xx,p[0:6])
+	## d log(sum of pulses)/dp from the log of each pulse (npulse,nx) and
+	## its derivatives (npulse,nparam,nx), weighted by the pulse's share
 
-	return f
+	with np.errstate(divide='ignore',invalid='ignore'):
+		logf=logsumexp(logp,axis=0)
+		w=np.where(np.isfinite(logf),np.exp(logp-logf),0.)
 
-def intgauss6_bkn2pow(xx,*p):
+	return _pulses_jac(w[:,np.newaxis,:]*dlogp,None)
 
-	f=intgauss(xx,p[7:10])+intgauss(xx,p[10:13])+intgauss(xx,p[13:16])+intgauss(xx,p[16:19])+intgauss(xx,p[19:22])\
-		+intgauss(xx,p[22:25])+intbkn2pow(xx,p[0:6])
+def loggauss_pulses_jac(x,p):
 
-	return f
+	x=_points(x)
+	p=np.reshape(p,(-1,3,1))
+	norm=p[:,0]
+	center=p[:,1]
+	width=p[:,2]
 
-def intgauss1_bkn3pow(xx,*p):
+	dx=x-center
+	with np.errstate(divide='ignore',invalid='ignore'):
+		logp=np.log(norm)-dx**2/(2.*width**2)
+	dlogp=np.stack((np.zeros(dx.shape)+1./norm,dx/width**2,dx**2/width**3),axis=1)
 
-	f=intgauss(xx,p[5:8])+intbkn3pow(xx,p[0:6])
+	return _logpulses_jac(logp,dlogp)
 
-	return f
+def lognorris_pulses_jac(x,p):
 
-def intgauss2_bkn3pow(xx,*p):
+	x=_points(x)
+	p=np.reshape(p,(-1,4,1))
+	norm=p[:,0]
+	start=p[:,1]
+	rise=p[:,2]
+	decay=p[:,3]
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intbkn3pow(xx,p[0:6])
+	u=x-start
+	up=np.where(u > 0,u,1.)
+	with np.errstate(divide='ignore',invalid='ignore'):
+		logp=np.where(u > 0,np.log(norm)+2*np.sqrt(rise/decay)-rise/up-up/decay,-np.inf)
+	dstart,drise,ddecay=_norris_dlog(up,rise,decay)
+	dlogp=np.stack((np.zeros(u.shape)+1./norm,-dstart,drise,ddecay),axis=1)
 
-	return f
+	return _logpulses_jac(logp,dlogp)
 
-def intgauss3_bkn3pow(xx,*p):
+def _dlogpowint_da(a,lu,lv):
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intbkn3pow(xx,p[0:6])
+	## d/da of the log of the integral of x**(a-1) from exp(lu) to exp(lv),
+	## lu + d/(1-exp(-a*d)) - 1/a with d=lv-lu, by its series for small a*d
 
-	return f
+	d=lv-lu
+	ad=a*d
+	with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+		r=lu+d/(-np.expm1(-ad))-1./a
 
-def intgauss4_bkn3pow(xx,*p):
+	return np.where(abs(ad) < 1e-6,lu+d*(0.5+ad/12.),r)
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intbkn3pow(xx,p[0:6])
+def logintpowerlaw_jac(xx,p):
 
-	return f
+	## d log(f)/dp of the bin-averaged broken power law, from the log space
+	## derivatives of its pieces weighted by their share of the bin's
+	## integral, so it holds where f over- or underflows and for pow=1.
+	## The pieces' bounds are held fixed as in intnbknpow_jac.
 
-def intgauss5_bkn3pow(xx,*p):
+	p=np.asarray(p,dtype=float)
+	norm=p[0]
+	pows=p[1::2]
+	breaks=p[2::2]
+	nseg=len(pows)
+	npar=len(p)
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intgauss(xx,p[17:20])\
-		+intbkn3pow(xx,p[0:6])
+	x0,x1,dx=_edges(xx)
+	l0,l1=_logedges(xx)
+	logb=np.log(breaks)
+	s0,s1,first,last=_bkn_bins(x0,x1,breaks,bounds=(l0,l1,logb))
+	lognorm,dpow,dbreak=_bkn_lognorm(pows,breaks)
+	logn=np.log(norm)+lognorm
+	a=1.-pows
+	logf=logintpowerlaw(xx,p)+np.log(dx)
+
+	def piece(s,u,v):
+		j=np.empty((len(s),npar))
+		j[:,0]=1./norm
+		j[:,1::2]=dpow[s]
+		j[np.arange(len(s)),1+2*s]-=_dlogpowint_da(a[s],u,v)
+		j[:,2::2]=dbreak[s]
+		return _logpowint(logn[s],a[s],u,v),j
 
-	return f
+	logp,j=piece(s0,first[0],first[1])
+	j*=np.exp(logp-logf)[:,np.newaxis]
 
-def intgauss6_bkn3pow(xx,*p):
+	split=s1 > s0
+	if np.any(split):
+		lf=logf[split]
+		logp,jl=piece(s1[split],last[0][split],last[1][split])
+		j[split]+=np.exp(logp-lf)[:,np.newaxis]*jl
+		if nseg > 2:
+			k=np.arange(1,nseg-1)
+			logp,jf=piece(k,logb[:-1],logb[1:])
+			inside=(k > s0[split][:,np.newaxis]) & (k < s1[split][:,np.newaxis])
+			j[split]+=np.dot(np.where(inside,np.exp(logp-lf[:,np.newaxis]),0.),jf)
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intgauss(xx,p[17:20])\
-		+intgauss(xx,p[20:23])+intbkn3pow(xx,p[0:6])
+	return j
 
-	return f
+def _pulses_jac(j,out):
 
-def intgauss1_bkn4pow(xx,*p):
+	## (npulse,nparam,nx) derivatives as (nx,npulse*nparam), into out if given
 
-	f=intgauss(xx,p[5:8])+intbkn4pow(xx,p[0:8])
+	j=j.reshape(-1,j.shape[-1]).T
+	if out is None:
+		return j
+	out[...]=j
 
-	return f
+	return out
 
-def intgauss2_bkn4pow(xx,*p):
+def gauss_pulses_jac(x,p,out=None):
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intbkn4pow(xx,p[0:8])
+	x=_points(x)
+	p=np.reshape(p,(-1,3,1))
+	norm=p[:,0]
+	center=p[:,1]
+	width=p[:,2]
 
-	return f
+	dx=x-center
+	g=np.exp(-dx**2/(2.*width**2))
+	dnorm=g
+	dcenter=norm*g*dx/width**2
+	dwidth=dcenter*dx/width
 
-def intgauss3_bkn4pow(xx,*p):
+	j=np.stack((dnorm,dcenter,dwidth),axis=1)
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intbkn4pow(xx,p[0:8])
+	return _pulses_jac(j,out)
 
-	return f
+def intgauss_pulses_jac(xx,p,out=None):
+
+	x0,x1,dx=_edges(xx)
+	p=np.reshape(p,(-1,3,1))
+	norm=p[:,0]
+	center=p[:,1]
+	width=p[:,2]
 
-def intgauss4_bkn4pow(xx,*p):
+	s=np.sqrt(2.)*width
+	d0=x0-center
+	d1=x1-center
+	g0=np.exp(-d0**2/(2.*width**2))
+	g1=np.exp(-d1**2/(2.*width**2))
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intbkn4pow(xx,p[0:8])
+	e=np.sqrt(np.pi/2.)*_erf_diff(d0/s,d1/s)/dx
+	dnorm=width*e
+	dcenter=norm*(g0-g1)/dx
+	dwidth=norm*(e-(d1*g1-d0*g0)/(width*dx))
 
-	return f
+	j=np.stack((dnorm,dcenter,dwidth),axis=1)
 
-def intgauss5_bkn4pow(xx,*p):
+	return _pulses_jac(j,out)
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intgauss(xx,p[17:20])\
-		+intbkn4pow(xx,p[0:8])
+def _norris_dlog(u,rise,decay):
 
-	return f
+	## derivatives of log(pulse) w.r.t. start, rise & decay at u=t-start
 
-def intgauss6_bkn4pow(xx,*p):
+	k=np.sqrt(rise/decay)
+	dstart=rise/u**2-1./decay
+	drise=k/rise-1./u
+	ddecay=u/decay**2-k/decay
+
+	return dstart,drise,ddecay
+
+def norris_pulses_jac(x,p,out=None):
+
+	x=_points(x)
+	p=np.reshape(p,(-1,4,1))
+	norm=p[:,0]
+	start=p[:,1]
+	rise=p[:,2]
+	decay=p[:,3]
+
+	u=x-start
+	up=np.where(u > 0,u,1.)
+	g=np.where(u > 0,np.exp(2*np.sqrt(rise/decay)-rise/up-up/decay),0.)
+	dstart,drise,ddecay=_norris_dlog(up,rise,decay)
+	f=norm*g
+
+	j=np.stack((g,-f*dstart,f*drise,f*ddecay),axis=1)
+
+	return _pulses_jac(j,out)
 
-	f=intgauss(xx,p[5:8])+intgauss(xx,p[8:11])+intgauss(xx,p[11:14])+intgauss(xx,p[14:17])+intgauss(xx,p[17:20])\
-		+intgauss(xx,p[20:23])+intbkn4pow(xx,p[0:8])
+def intnorris_pulses_jac(xx,p,out=None):
 
-	return f
+	## derivatives under the integral with the same quadrature, the pulse
+	## is negligible at the clipped ends so they contribute nothing
+
+	u,w,p=_norris_quad(xx,p)
+	norm=p[...,0,:,0]
+	rise=p[...,2,:,:]
+	decay=p[...,3,:,:]
+
+	wg=w*np.exp(2*np.sqrt(rise/decay)-rise/u-u/decay)
+	dstart,drise,ddecay=_norris_dlog(u,rise,decay)
+
+	dx=_edges(xx)[2]
+	j=np.stack((np.sum(wg,axis=2),
+		-norm*np.sum(wg*dstart,axis=2),
+		norm*np.sum(wg*drise,axis=2),
+		norm*np.sum(wg*ddecay,axis=2)),axis=1)/dx
+
+	return _pulses_jac(j,out)
+
+def check_jacobian(func,x,*p,**kwargs):
+
+	## compare func.jac against central finite differences at p
+	## returns (analytic, numerical, max relative difference per parameter)
+
+	eps=kwargs.get('eps',1e-6)
+	verbose=kwargs.get('verbose',True)
+
+	p=np.asarray(p,dtype=float)
+	jac=np.array(func.jac(x,*p))
+	num=np.empty(jac.shape)
+	for i in range(len(p)):
+		h=eps*max(abs(p[i]),1.)
+		pp=p.copy()
+		pm=p.copy()
+		pp[i]=pp[i]+h
+		pm[i]=pm[i]-h
+		num[:,i]=np.array(func(x,*pp))
+		num[:,i]=(num[:,i]-func(x,*pm))/(2.*h)
+
+	scale=np.maximum(np.max(abs(num),axis=0),np.max(abs(jac),axis=0))
+	scale[scale == 0]=1.
+	diff=np.max(abs(jac-num),axis=0)/scale
+
+	if verbose:
+		pnames=getattr(func,'pnames',[str(i) for i in range(len(p))])
+		for i in range(len(p)):
+			print(pnames[i]+' '+str(diff[i]))
+
+	return jac,num,diff
+
+############ MODEL BUILDER
+
+def gauss_to_norris(g):
+
+	## Norris pulses with rise=decay=tau peaking at the gaussian centers,
+	## tau from matching the FWHM (1.80 tau vs 2.355 width)
+
+	g=np.reshape(g,(-1,3))
+	tau=2.355/1.80*g[:,2]
+
+	return np.vstack((g[:,0],g[:,1]-tau,tau,tau)).T
+
+## pulse families: name -> point and bin-integrated kernels, their jacobians,
+## the log of the point kernel & its jacobian and parameter names. Kernels take (x,p) with
+## p = len(pnames) parameters
+## per pulse. guess converts (n,3) gaussian norm, center, width guesses (as
+## found by fit_lc.find_flares) to the family's parameters. positive lists
+## the parameters that must be > 0. bounds(t0,t1) gives the physical (lower,
+## upper) bounds of the parameters for data from t0 to t1. time is the index
+## of the parameter placing the pulse in time. work is the number of float64
+## temporaries per bin the point & bin-integrated kernels need for each pulse
+pulse_models={
+	'gauss': {'model': gauss_pulses, 'intmodel': intgauss_pulses,
+		'jac': gauss_pulses_jac, 'intjac': intgauss_pulses_jac,
+		'logmodel': loggauss_pulses, 'logjac': loggauss_pulses_jac,
+		'pnames': ('norm','center','width'),
+		'guess': lambda g: g,
+		'positive': (2,),
+		'time': 1,
+		'work': (3,12),
+		'bounds': lambda t0,t1: ((0.,t0,0.),(np.inf,t1,t1-t0))},
+	'norris': {'model': norris_pulses, 'intmodel': intnorris_pulses,
+		'jac': norris_pulses_jac, 'intjac': intnorris_pulses_jac,
+		'logmodel': lognorris_pulses, 'logjac': lognorris_pulses_jac,
+		'pnames': ('norm','start','rise','decay'),
+		'guess': gauss_to_norris,
+		'positive': (2,3),
+		'time': 1,
+		'work': (4,4*len(norris_nodes)),
+		'bounds': lambda t0,t1: ((0.,0.,0.,0.),(np.inf,t1,np.inf,t1-t0))},
+}
+
+_model_cache={}
+
+def model_name(numflares,numbreaks,pulse='gauss',integrated=False):
+
+	## canonical model name, e.g. (3,2) -> gauss3_bkn2pow, (0,0) -> pow
+
+	if numbreaks is None:
+		cont=''
+	elif numbreaks == 0:
+		cont='pow'
+	elif numbreaks == 1:
+		cont='bknpow'
+	else:
+		cont='bkn'+str(numbreaks)+'pow'
+
+	if numflares == 0:
+		model=cont
+	elif not cont:
+		model=pulse+str(numflares)
+	else:
+		model=pulse+str(numflares)+'_'+cont
+
+	if integrated:
+		model='int'+model
+
+	return model
+
+def parse_model(spec):
+
+	## parse a model name (gauss3_bkn2pow, intpow, ...) or an expression
+	## like '3 flares + 2 breaks' or 'norris x2 + pow' into
+	## (pulse, numflares, numbreaks, integrated)
+	## numbreaks is None for a model with no power law continuum
+
+	try:
+		spec=spec.decode('utf-8')
+	except AttributeError:
+		pass
+	spec=spec.lower().replace(u'\u00d7','x').replace(' ','')
+	integrated=spec.startswith('int')
+	if integrated:
+		spec=spec[3:]
+
+	pulse='gauss'
+	numflares=0
+	numbreaks=None
+	for term in re.split(r'\+|_',spec):
+		cont=re.match(r'^(pow|bknpow|bkn(\d+)pow)$',term)
+		flares=re.match(r'^(\d*)(?:x|\*)?flares?$',term)
+		breaks=re.match(r'^(\d*)(?:x|\*)?breaks?$',term)
+		p1=re.match(r'^([a-z]+?)(?:x|\*)?(\d*)$',term)
+		p2=re.match(r'^(\d+)(?:x|\*)?([a-z]+)$',term)
+		if cont:
+			if cont.group(1) == 'pow':
+				numbreaks=0
+			elif cont.group(1) == 'bknpow':
+				numbreaks=1
+			else:
+				numbreaks=int(cont.group(2))
+		elif flares:
+			numflares=numflares+int(flares.group(1) or 1)
+		elif breaks:
+			numbreaks=(numbreaks or 0)+int(breaks.group(1) or 1)
+		elif p1:
+			pulse=p1.group(1)
+			numflares=numflares+int(p1.group(2) or 1)
+		elif p2:
+			pulse=p2.group(2)
+			numflares=numflares+int(p2.group(1))
+		else:
+			raise ValueError('Cannot parse model term "'+term+'" in '+spec)
+
+	if numbreaks is None and numflares == 0:
+		raise ValueError('Empty model: '+spec)
+
+	return str(pulse),numflares,numbreaks,integrated
+
+def build_model(spec,integrated=None):
+
+	## return a compiled, cached model function f(x,*p) for a model name or
+	## expression (see parse_model). Parameters are ordered continuum first
+	## (norm, pow1, break1, pow2, ...) then those of each pulse (3 for gauss:
+	## norm, center, width; 4 for norris: norm, start, rise, decay). Integrated models
+	## take xx=[tstart,tstop] instead of x.
+	## f.log(x,*p) & f.logbatch(x,p) give the log of the model, with the
+	## continuum in log space and the pulses added by log-sum-exp, and
+	## f.logjac(x,*p) its derivatives. f.evaluate(x,p) evaluates it for many
+	## parameter sets p (nsets,npar) at once (see evaluate)
+
+	pulse,numflares,numbreaks,intmodel=parse_model(spec)
+	if integrated is not None:
+		intmodel=integrated
+	name=model_name(numflares,numbreaks,pulse=pulse,integrated=intmodel)
+	if name in _model_cache:
+		return _model_cache[name]
+
+	if pulse not in pulse_models:
+		raise ValueError('Pulse model '+pulse+' not implemented')
+	kernels=pulse_models[pulse]
+
+	if numbreaks is None:
+		ncont=0
+	else:
+		ncont=2+2*numbreaks
+	nump=ncont+len(kernels['pnames'])*numflares
+
+	if intmodel:
+		pulses=kernels['intmodel']
+		pulses_jac=kernels['intjac']
+		cont=intpowerlaw
+		cont_jac=intnbknpow_jac
+		logcont=logintpowerlaw
+		logcont_jac=logintpowerlaw_jac
+		def logpulses(x,p):
+			with np.errstate(divide='ignore',invalid='ignore'):
+				return np.log(pulses(x,p))
+		def logpulses_jac(x,p):
+			## 0 where the pulses vanish
+			f=pulses(x,p)
+			with np.errstate(divide='ignore',invalid='ignore'):
+				return np.where((f > 0)[:,np.newaxis],pulses_jac(x,p)/f[:,np.newaxis],0.)
+	else:
+		pulses=kernels['model']
+		pulses_jac=kernels['jac']
+		cont=powerlaw
+		cont_jac=nbknpow_jac
+		logcont=logpowerlaw
+		logcont_jac=logpowerlaw_jac
+		logpulses=kernels['logmodel']
+		logpulses_jac=kernels['logjac']
+
+	## batch(x,p) takes parameter sets along the leading axes of p
+	## on an lc_grid, f & jac write into its buffers (see lc_grid)
+	if numflares == 0:
+		def batch(x,p,out=None):
+			return cont(x,p[...,0:ncont],out=out)
+		def _jac(x,p,out=None):
+			return cont_jac(x,p[0:ncont],out=out)
+		def logbatch(x,p):
+			return logcont(x,p[...,0:ncont])
+		def _logjac(x,p):
+			return logcont_jac(x,p[0:ncont])
+	elif ncont == 0:
+		def batch(x,p,out=None):
+			return pulses(x,p[...,0:nump],out=out)
+		def _jac(x,p,out=None):
+			return pulses_jac(x,p[0:nump],out=out)
+		def logbatch(x,p):
+			return logpulses(x,p[...,0:nump])
+		def _logjac(x,p):
+			return logpulses_jac(x,p[0:nump])
+	else:
+		def batch(x,p,out=None):
+			f=cont(x,p[...,0:ncont],out=out)
+			f+=pulses(x,p[...,ncont:nump])
+			return f
+		def _jac(x,p,out=None):
+			if out is None:
+				return np.hstack((cont_jac(x,p[0:ncont]),pulses_jac(x,p[ncont:nump])))
+			cont_jac(x,p[0:ncont],out=out[:,0:ncont])
+			pulses_jac(x,p[ncont:nump],out=out[:,ncont:nump])
+			return out
+		def logbatch(x,p):
+			return np.logaddexp(logcont(x,p[...,0:ncont]),logpulses(x,p[...,ncont:nump]))
+		def _logjac(x,p):
+			## each component's derivatives weighted by its share of f
+			logc=logcont(x,p[0:ncont])
+			logp=logpulses(x,p[ncont:nump])
+			logf=np.logaddexp(logc,logp)
+			return np.hstack((logcont_jac(x,p[0:ncont])*np.exp(logc-logf)[:,np.newaxis],
+				logpulses_jac(x,p[ncont:nump])*np.exp(logp-logf)[:,np.newaxis]))
+
+	def f(x,*p):
+		if isinstance(x,lc_grid):
+			return batch(x,np.asarray(p,dtype=float),out=x.buffer(name))
+		return batch(x,np.asarray(p,dtype=float))
+
+	def jac(x,*p):
+		if isinstance(x,lc_grid):
+			return _jac(x,np.asarray(p,dtype=float),out=x.buffer(name+'_jac',nump))
+		return _jac(x,np.asarray(p,dtype=float))
+
+	def log(x,*p):
+		return logbatch(x,np.asarray(p,dtype=float))
+
+	def logjac(x,*p):
+		return _logjac(x,np.asarray(p,dtype=float))
+
+	def evaluate_many(x,p,chunk=None,log=False):
+		return evaluate(f,x,p,chunk=chunk,log=log)
+
+	pnames=['norm']
+	for i in range(ncont//2-1):
+		pnames=pnames+['pow'+str(i+1),'break'+str(i+1)]
+	if ncont:
+		pnames=pnames+['pow'+str(ncont//2)]
+	else:
+		pnames=[]
+	for i in range(numflares):
+		pnames=pnames+[pulse[0]+n+str(i+1) for n in kernels['pnames']]
+
+	f.__name__=str(name)
+	f.model=name
+	f.pulse=pulse
+	f.numflares=numflares
+	f.numbreaks=numbreaks
+	f.nump=nump
+	f.ncont=ncont
+	f.integrated=intmodel
+	## float64 temporaries per bin & parameter set of a batch (evaluate)
+	f.width=(10 if intmodel else 5)+numflares*kernels['work'][int(intmodel)]
+	f.pnames=pnames
+	f.jac=jac
+	f.batch=batch
+	f.evaluate=evaluate_many
+	f.log=log
+	f.logbatch=logbatch
+	f.logjac=logjac
+	_model_cache[name]=f
+
+	return f
+
+class model_library:
+
+	## dictionary-like access to models by name, built on demand
+	## e.g. models['gauss3_bkn2pow'], models['intgauss3_bkn2pow']
+
+	def __getitem__(self,name):
+		return build_model(name)
+
+	def __contains__(self,name):
+		try:
+			build_model(name)
+		except ValueError:
+			return False
+		return True
+
+models=model_library()
@@ -8,18 +8,27 @@ Light curve fitting
 """
 
 import numpy as np
-from astropy.io import ascii
 from astropy.io import fits
-from astropy.table import Table,Column,join
+from astropy.table import Table,Column,MaskedColumn
 import math
 import os
+from collections import OrderedDict
 import matplotlib.pylab as plot
 import fit_functions
 import re
 import time
-from scipy.optimize import curve_fit
+import zipfile
+from scipy.optimize import curve_fit,least_squares,minimize,nnls
 
-def fit_the_lc(grbdict=None,lc=None):
+def fit_the_lc(grbdict=None,lc=None,check_jac=False,auto=False,pulse='gauss',stat='chisq',\
+	solver='curve_fit',nstarts=1):
+
+	## check_jac - compare the analytic jacobian against finite differences at p0
+	## auto - use auto_initial_conditions instead of clicking flares & breaks
+	## pulse - flare model for auto ('gauss' or 'norris')
+	## stat - fit statistic, 'censored' to use the upper limits (see fit_lc_model)
+	## solver - 'bounded' for the bounded least squares fit (see fit_lc_model)
+	## nstarts - number of starting points around p0 (see multistart_fit)
 
 	if grbdict:
 		lc=grbdict.lc
@@ -29,25 +38,24 @@ def fit_the_lc(grbdict=None,lc=None):
 			print('Need to specify either GRB dictionary or lc')
 			return
 
-	p0,model,fmodel,pnames=click_initial_conditions(lc=lc)
+	if auto:
+		p0,model,fmodel,pnames=auto_initial_conditions(lc=lc,pulse=pulse)
+	else:
+		p0,model,fmodel,pnames=click_initial_conditions(lc=lc)
 	print('Fitting '+model+':')
-	tt=np.array([lc['Time']+lc['T_-ve'],lc['Time']+lc['T_+ve']])
-	popt, pcov=curve_fit(fmodel['int'+model],tt,lc['Rate'],p0=p0,sigma=lc['Ratepos'])
-	perr = np.sqrt(np.diag(pcov))
+	if nstarts > 1:
+		p=multistart_fit(lc,p0,model,pnames=pnames,nstarts=nstarts,stat=stat,solver=solver)
+	else:
+		p=fit_lc_model(lc,p0,model,fmodel=fmodel,pnames=pnames,check_jac=check_jac,stat=stat,\
+			solver=solver)
 	plot.close()
 
 	print('Result par, val, err:')
-	print(popt)
-	print(perr)
-	yfit=fmodel[model](np.array(lc['Time']),*popt)
+	print(p.par)
+	print(p.perror[:,1])
+	yfit=fmodel[model](np.array(lc['Time']),*p.par)
 
-
-	r = lc['Rate']- yfit
-	chisq=sum((r/lc['Ratepos'])**2)
-	dof=len(lc['Rate'])+len(p0)
-	p=fit_params(model,pnames,popt,perr,perr,chisq,dof)
-
-	print('Chisq = '+str(chisq/dof))
+	print('Chisq = '+str(p.chisq/p.dof))
 	fig,ax1=plot_lcfit(lc=lc,noshow=True)
 	ax1.plot(np.array(lc['Time']),yfit,color='orange')
 
@@ -59,6 +67,894 @@ def fit_the_lc(grbdict=None,lc=None):
 
 	return	p
 
+def fit_lc_model(lc,p0,model,fmodel=None,pnames=None,check_jac=False,stat='chisq',ulsigma=3.,\
+	cash_types=None,method='L-BFGS-B',errors='covar',seed=None,nboot=200,maxtime=None,nproc=None,\
+	solver='curve_fit',max_nfev=None,fit_time=None):
+
+	## fit model to lc starting from p0 with no plots or prompts
+	## stat - 'chisq': every row is a detection with error Ratepos
+	##        'censored': WTUL/PCUL rows are upper limits, only penalized
+	##        where the model is above them (see censored_residuals)
+	##        'cstat': Poisson (Cash) statistic on the counts of the rows of
+	##        cash_types, chisq on the other detections (see cash_objective)
+	##        'logchisq': chisq of log(rate) with errors Ratepos/Rate, on the
+	##        model evaluated in log space (see log_residuals)
+	## ulsigma - significance of the upper limits (Swift's are 3 sigma)
+	## cash_types - light curve types fitted with the Cash statistic, e.g.
+	##        ('PC',) for the low count late bins only. None = all with counts
+	## method - scipy.optimize.minimize method for stat='cstat'
+	## errors - 'covar': symmetric errors from the covariance matrix
+	##        'mcmc': asymmetric 1 sigma credible intervals from an ensemble
+	##        sampler started at the best fit (see mcmc_errors)
+	##        'bootstrap': 1 sigma percentile intervals of refits to light
+	##        curves perturbed within their errors (see bootstrap_errors)
+	## seed - random seed for errors='mcmc' or 'bootstrap'
+	## nboot, maxtime, nproc - number of refits, wall-time budget (s) and
+	##        processes for errors='bootstrap'
+	## solver - for stat='chisq': 'curve_fit' (unconstrained) or 'bounded'
+	##        (see bounded_fit), which stops after max_nfev evaluations or
+	##        fit_time seconds. The other stats only take 'curve_fit'
+	## returns a fit_params object (used by fit_the_lc and batch_fit), with
+	## the covariance matrix in pcov and, for stat='cstat', minimize's
+	## success and message
+
+	if fmodel is None:
+		fmodel=fit_functions.models
+	if pnames is None:
+		pnames=fmodel[model].pnames
+	if solver not in ('curve_fit','bounded'):
+		raise ValueError('Unknown solver: '+str(solver))
+	if (solver == 'bounded') and (stat != 'chisq'):
+		raise ValueError('solver=\'bounded\' only supports stat=\'chisq\', not '+str(stat))
+
+	tt=fit_grid(lc)
+	f=fmodel['int'+model]
+	if check_jac:
+		print('Jacobian check (max relative difference per parameter):')
+		fit_functions.check_jacobian(f,tt,*p0)
+
+	if stat == 'censored':
+		ul=np.array(['UL' in str(t) for t in lc['Type']])
+		resid,jac=censored_residuals(f,tt,lc['Rate'],lc['Ratepos'],ul,ulsigma=ulsigma)
+		res=least_squares(resid,p0,jac=jac,method='lm')
+		popt=res.x
+		pcov=fit_covariance(res.jac,2*res.cost,np.sum(~ul)-len(p0))
+		yfit=fmodel[model](np.array(lc['Time']),*popt)
+		r=point_residuals(yfit,lc['Rate'],lc['Ratepos'],ul,ulsigma=ulsigma)
+		chisq=np.sum(r**2)
+		dof=np.sum(~ul)-len(p0)
+	elif stat == 'logchisq':
+		resid,jac,use=log_residuals(f,tt,lc['Rate'],lc['Ratepos'],lc['Type'])
+		res=least_squares(resid,p0,jac=jac,method='lm')
+		popt=res.x
+		chisq=2*res.cost
+		dof=np.sum(use)-len(p0)
+		pcov=fit_covariance(res.jac,chisq,dof)
+	elif stat == 'cstat':
+		cstat,grad,fisher,use=cash_objective(f,tt,lc,cash_types=cash_types)
+		## minimize in units of p0 so all parameters are of order 1
+		scale=np.where(np.asarray(p0,dtype=float) != 0,np.abs(p0),1.)
+		res=minimize(lambda q: cstat(q*scale),np.ones(len(p0)),method=method,\
+			jac=lambda q: grad(q*scale)*scale)
+		popt=res.x*scale
+		pcov=fit_covariance(fisher(popt))
+		## the statistic in place of chisq (with the same bin-integrated model)
+		chisq=cstat(popt)
+		dof=np.sum(use)-len(p0)
+	elif (stat == 'chisq') and (solver == 'bounded'):
+		popt,pcov,chisq,nfev=bounded_fit(f,tt,lc,p0,max_nfev=max_nfev,fit_time=fit_time)
+		dof=len(lc['Rate'])-len(p0)
+	elif stat == 'chisq':
+		popt, pcov=curve_fit(lambda x,*p: f(tt,*p),tt.xx,lc['Rate'],p0=p0,sigma=lc['Ratepos'],\
+			jac=lambda x,*p: f.jac(tt,*p))
+		yfit=fmodel[model](np.array(lc['Time']),*popt)
+		r=(lc['Rate']-yfit)/lc['Ratepos']
+		chisq=np.sum(r**2)
+		dof=len(lc['Rate'])-len(p0)
+	else:
+		raise ValueError('Unknown fit statistic: '+str(stat))
+
+	perr = np.sqrt(np.diag(pcov))
+	p=fit_params(model,pnames,popt,perr,perr,chisq,dof)
+	p.pcov=pcov
+	if (stat == 'chisq') and (solver == 'bounded'):
+		p.nfev=nfev
+	if stat == 'cstat':
+		## minimize's convergence flag and reason
+		p.success=bool(res.success)
+		p.message=str(res.message)
+		if not p.success:
+			print('Warning: cstat fit did not converge: '+p.message)
+
+	if errors == 'mcmc':
+		p=mcmc_errors(lc,p,fmodel=fmodel,stat=stat,ulsigma=ulsigma,cash_types=cash_types,seed=seed)
+	elif errors == 'bootstrap':
+		p=bootstrap_errors(lc,p,stat=stat,ulsigma=ulsigma,cash_types=cash_types,nboot=nboot,\
+			maxtime=maxtime,nproc=nproc,seed=seed,method=method,solver=solver,max_nfev=max_nfev,\
+			fit_time=fit_time)
+	elif errors != 'covar':
+		raise ValueError('Unknown error method: '+str(errors))
+
+	return p
+
+def fit_grid(lc):
+
+	## the bins of lc for the bin-integrated models, precomputed once per fit
+	## (fit_functions.lc_grid)
+
+	tt=np.array([lc['Time']+lc['T_-ve'],lc['Time']+lc['T_+ve']])
+
+	return fit_functions.lc_grid(tt,t=lc['Time'])
+
+class FitBudgetExceeded(Exception):
+	pass
+
+def fit_bounds(lc,f):
+
+	## physical (lower, upper) bounds of the parameters of model f for the
+	## light curve lc: positive norms, pows within -5 to 10, breaks within
+	## the data and the pulses' bounds (fit_functions.pulse_models)
+	## returns lower, upper and which parameters are fitted in log space
+	## (the norms and the breaks)
+
+	t0=np.min(np.asarray(lc['Time']+lc['T_-ve'],dtype=float))
+	t1=np.max(np.asarray(lc['Time']+lc['T_+ve'],dtype=float))
+	lower=np.zeros(f.nump)
+	upper=np.zeros(f.nump)
+	logpar=np.zeros(f.nump,dtype=bool)
+
+	if f.ncont:
+		lower[0]=0.
+		upper[0]=np.inf
+		lower[1:f.ncont:2]=-5.
+		upper[1:f.ncont:2]=10.
+		lower[2:f.ncont:2]=t0
+		upper[2:f.ncont:2]=t1
+		logpar[0:f.ncont:2]=True
+	if f.numflares:
+		lo,hi=fit_functions.pulse_models[f.pulse]['bounds'](t0,t1)
+		lower[f.ncont:]=np.tile(lo,f.numflares)
+		upper[f.ncont:]=np.tile(hi,f.numflares)
+		logpar[f.ncont::len(lo)]=True
+
+	return lower,upper,logpar
+
+def bounded_fit(f,tt,lc,p0,max_nfev=None,fit_time=None):
+
+	## chisq fit of model f with scipy's least_squares (trf) inside
+	## fit_bounds, norms & breaks in log space. The asymmetric errors are
+	## used as sign-dependent weights: Ratepos where the model is above the
+	## rate, -Rateneg where it is below. p0 is moved inside the bounds.
+	## max_nfev - maximum number of model evaluations (least_squares' default
+	## if None)
+	## fit_time - seconds after which the best point so far is returned
+	## returns popt, pcov, chisq and the number of model evaluations
+
+	rate=np.asarray(lc['Rate'],dtype=float)
+	errpos=np.asarray(lc['Ratepos'],dtype=float)
+	if 'Rateneg' in lc.keys():
+		errneg=-np.ma.filled(np.ma.asarray(lc['Rateneg'],dtype=float),np.nan)
+		errneg=np.where(np.isfinite(errneg) & (errneg > 0),errneg,errpos)
+	else:
+		errneg=errpos
+
+	lower,upper,logpar=fit_bounds(lc,f)
+	def to_q(p):
+		q=np.array(p,dtype=float)
+		with np.errstate(divide='ignore'):
+			q[logpar]=np.log(q[logpar])
+		return q
+	def to_p(q):
+		p=np.array(q,dtype=float)
+		p[logpar]=np.exp(p[logpar])
+		return p
+
+	qlo=to_q(lower)
+	qhi=to_q(upper)
+	margin=1e-6*np.where(np.isfinite(qhi-qlo),qhi-qlo,1.)
+	q0=np.clip(to_q(np.maximum(p0,np.where(logpar,1e-300,-np.inf))),qlo+margin,qhi-margin)
+
+	## the weights of the last residuals are reused by the jacobian
+	t0=time.time()
+	best={'cost':np.inf,'q':q0,'nfev':0}
+	last={}
+	def resid(q):
+		if fit_time and (time.time()-t0 > fit_time):
+			raise FitBudgetExceeded()
+		y=f(tt,*to_p(q))
+		sig=np.where(y > rate,errpos,errneg)
+		r=(y-rate)/sig
+		last['q']=np.array(q)
+		last['sig']=sig
+		best['nfev']=best['nfev']+1
+		cost=np.sum(r**2)
+		if cost < best['cost']:
+			best['cost']=cost
+			best['q']=np.array(q)
+		return r
+	def jac(q):
+		p=to_p(q)
+		if ('q' not in last) or np.any(last['q'] != q):
+			resid(q)
+		j=f.jac(tt,*p)/last['sig'][:,np.newaxis]
+		j[:,logpar]*=p[logpar]
+		return j
+
+	try:
+		res=least_squares(resid,q0,jac=jac,bounds=(qlo,qhi),method='trf',x_scale='jac',\
+			max_nfev=max_nfev)
+		q=res.x
+	except FitBudgetExceeded:
+		print('Fit stopped after '+str(fit_time)+' s')
+		q=best['q']
+
+	popt=to_p(q)
+	y=f(tt,*popt)
+	sig=np.where(y > rate,errpos,errneg)
+	chisq=np.sum(((y-rate)/sig)**2)
+	pcov=fit_covariance(f.jac(tt,*popt)/sig[:,np.newaxis],chisq,len(rate)-len(popt))
+
+	return popt,pcov,chisq,best['nfev']
+
+def point_residuals(yfit,rate,err,ul,ulsigma=3.):
+
+	## normalized residuals (model-rate)/err of detections & the one-sided
+	## residuals of upper limits: (model-limit)/(limit/ulsigma) where the
+	## model is above the limit, 0 below it
+
+	rate=np.asarray(rate,dtype=float)
+	sig=np.where(ul,rate/ulsigma,np.asarray(err,dtype=float))
+	r=(yfit-rate)/sig
+
+	return np.where(ul & (r < 0),0.,r)
+
+def censored_residuals(f,tt,rate,err,ul,ulsigma=3.):
+
+	## residual & jacobian functions of p for least_squares with upper
+	## limits (rows where ul is True) treated as censored data
+	## the last model evaluation is reused by the jacobian
+
+	rate=np.asarray(rate,dtype=float)
+	sig=np.where(ul,rate/ulsigma,np.asarray(err,dtype=float))
+	last={}
+
+	def resid(p):
+		r=(f(tt,*p)-rate)/sig
+		above=~ul | (r > 0)
+		last['p']=np.array(p)
+		last['above']=above
+		return np.where(above,r,0.)
+
+	def jac(p):
+		if ('p' not in last) or np.any(last['p'] != p):
+			resid(p)
+		return f.jac(tt,*p)/sig[:,np.newaxis]*last['above'][:,np.newaxis]
+
+	return resid,jac
+
+def log_residuals(f,tt,rate,err,types):
+
+	## residual & jacobian functions of p for least_squares in log(rate):
+	## (log model - log rate)/(err/rate) with the model evaluated in log
+	## space (f.log), so steep decays and large normalizations don't over-
+	## or underflow. Upper limits and rates <= 0 are left out (rows used
+	## returned). Parameter sets outside the model's domain (log of a
+	## negative norm) get large residuals so the step is rejected.
+
+	rate=np.asarray(rate,dtype=float)
+	use=np.array(['UL' not in str(t) for t in types]) & (rate > 0)
+	lograte=np.log(rate[use])
+	sig=np.asarray(err,dtype=float)[use]/rate[use]
+
+	def resid(p):
+		with np.errstate(invalid='ignore'):
+			r=(f.log(tt,*p)[use]-lograte)/sig
+		return np.where(np.isfinite(r),r,1e10)
+
+	def jac(p):
+		return f.logjac(tt,*p)[use]/sig[:,np.newaxis]
+
+	return resid,jac,use
+
+def cash_counts(lc):
+
+	## counts in the source region n, expected background counts b and the
+	## rate to counts factor k (Exposure/CorrFact) of each row, from the
+	## qdp count columns. Rows without an exposure have k=0 (no counts).
+
+	rate=np.asarray(lc['Rate'],dtype=float)
+	nrow=len(rate)
+	def column(name,default):
+		if name in lc.keys():
+			return np.ma.filled(np.ma.asarray(lc[name],dtype=float),default)
+		return np.zeros(nrow)+default
+
+	k=column('Exposure',0.)/column('CorrFact',1.)
+	b=column('BGInSrc',0.)
+	n=column('CtsInSrc',np.nan)
+	n=np.where(np.isfinite(n),n,np.round(rate*k+b))
+
+	return n,b,k
+
+def cash_objective(f,tt,lc,cash_types=None):
+
+	## Cash (2005) statistic on the counts of the rows of cash_types (all
+	## detections with counts if None), plus chisq on the other detections
+	## upper limit rows are left out
+	## model counts m = k*rate+b (see cash_counts), per row
+	## C = 2*(m-n+n*log(n/m)), which is chisq-like for many counts
+	## returns functions of p: statistic, its gradient, the jacobian of the
+	## fisher information's square root (for fit_covariance), and the rows used
+
+	rate=np.asarray(lc['Rate'],dtype=float)
+	err=np.asarray(lc['Ratepos'],dtype=float)
+	types=np.array([str(t) for t in lc['Type']])
+	n,b,k=cash_counts(lc)
+
+	det=np.array(['UL' not in t for t in types])
+	cash=det & (k > 0)
+	if cash_types is not None:
+		cash=cash & np.isin(types,cash_types)
+	chi=det & ~cash
+	nc=n[cash]
+	logn=np.where(nc > 0,np.log(np.where(nc > 0,nc,1.)),0.)
+
+	def counts(p):
+		y=f(tt,*p)
+		return y,np.maximum(k[cash]*y[cash]+b[cash],1e-300)
+
+	def cstat(p):
+		y,m=counts(p)
+		c=2*np.sum(m-nc+nc*(logn-np.log(m)))+np.sum(((y[chi]-rate[chi])/err[chi])**2)
+		## outside the model's domain (e.g. negative breaks), so line
+		## searches step back instead of failing
+		if not np.isfinite(c):
+			return np.inf
+		return c
+
+	def grad(p):
+		y,m=counts(p)
+		j=f.jac(tt,*p)
+		g=2*np.dot((1.-nc/m)*k[cash],j[cash])
+		return g+2*np.dot((y[chi]-rate[chi])/err[chi]**2,j[chi])
+
+	def fisher(p):
+		y,m=counts(p)
+		j=f.jac(tt,*p)
+		return np.vstack((j[cash]*(k[cash]/np.sqrt(m))[:,np.newaxis],\
+			j[chi]/err[chi][:,np.newaxis]))
+
+	return cstat,grad,fisher,det
+
+def stat_function(f,tt,lc,stat='chisq',ulsigma=3.,cash_types=None):
+
+	## fit statistic of model f for many parameter sets at once: returns a
+	## function of p (nsets,npar) giving the statistic of each set, with the
+	## model evaluated for all of them in chunked broadcasts (f.evaluate)
+
+	rate=np.asarray(lc['Rate'],dtype=float)
+	err=np.asarray(lc['Ratepos'],dtype=float)
+	types=np.array([str(t) for t in lc['Type']])
+	ul=np.array(['UL' in t for t in types])
+
+	if stat == 'chisq':
+		def fstat(p):
+			return np.sum(((f.evaluate(tt,p)-rate)/err)**2,axis=-1)
+	elif stat == 'censored':
+		def fstat(p):
+			return np.sum(point_residuals(f.evaluate(tt,p),rate,err,ul,ulsigma=ulsigma)**2,axis=-1)
+	elif stat == 'logchisq':
+		use=~ul & (rate > 0)
+		lograte=np.log(rate[use])
+		sig=err[use]/rate[use]
+		def fstat(p):
+			return np.sum(((f.evaluate(tt,p,log=True)[...,use]-lograte)/sig)**2,axis=-1)
+	elif stat == 'cstat':
+		n,b,k=cash_counts(lc)
+		cash=~ul & (k > 0)
+		if cash_types is not None:
+			cash=cash & np.isin(types,cash_types)
+		chi=~ul & ~cash
+		nc=n[cash]
+		logn=np.where(nc > 0,np.log(np.where(nc > 0,nc,1.)),0.)
+		def fstat(p):
+			y=f.evaluate(tt,p)
+			m=np.maximum(k[cash]*y[...,cash]+b[cash],1e-300)
+			return 2*np.sum(m-nc+nc*(logn-np.log(m)),axis=-1)+\
+				np.sum(((y[...,chi]-rate[chi])/err[chi])**2,axis=-1)
+	else:
+		raise ValueError('Unknown fit statistic: '+str(stat))
+
+	return fstat
+
+def model_prior(f,p):
+
+	## True for parameter sets p (nsets,npar) inside the physical range of
+	## model f: positive, increasing breaks and positive pulse widths/times
+
+	p=np.atleast_2d(p)
+	ok=np.ones(len(p),dtype=bool)
+	if f.ncont > 2:
+		breaks=p[:,2:f.ncont:2]
+		ok=ok & np.all(breaks > 0,axis=1) & np.all(np.diff(breaks,axis=1) > 0,axis=1)
+	if f.numflares:
+		pos=fit_functions.pulse_models[f.pulse]['positive']
+		pulses=p[:,f.ncont:f.nump].reshape(len(p),f.numflares,-1)
+		ok=ok & np.all(pulses[:,:,pos] > 0,axis=(1,2))
+
+	return ok
+
+def mcmc_errors(lc,p,fmodel=None,stat='chisq',ulsigma=3.,cash_types=None,nwalkers=None,\
+	maxsteps=20000,maxsamples=4000,seed=None,verbose=False):
+
+	## asymmetric errors of the fit p from an affine-invariant ensemble
+	## sampler (mcmc.sample) of exp(-stat/2) with a flat prior inside
+	## model_prior. The walkers start in a small ball around the best fit
+	## and the model is evaluated for half of them at a time in one broadcast.
+	## Sampling stops when the chains are 50 autocorrelation times long.
+	## returns a new fit_params with perror = median-16th & 84th-median
+	## percentiles and, compactly (float32, thinned), the samples. Also sets
+	## tau, acceptance & converged, and keeps pcov, nfev, success & message of p. Returns p
+	## (covariance errors) if the best fit is outside model_prior, e.g. with
+	## unsorted breaks.
+
+	import mcmc
+
+	if fmodel is None:
+		fmodel=fit_functions.models
+	f=fmodel['int'+p.model]
+	tt=fit_grid(lc)
+	fstat=stat_function(f,tt,lc,stat=stat,ulsigma=ulsigma,cash_types=cash_types)
+
+	def lnprob(x):
+		lp=np.zeros(len(x))-np.inf
+		ok=model_prior(f,x)
+		if np.any(ok):
+			with np.errstate(all='ignore'):
+				lp[ok]=-0.5*fstat(x[ok])
+		lp[~np.isfinite(lp)]=-np.inf
+		return lp
+
+	par=np.array(p.par,dtype=float)
+	npar=len(par)
+	if nwalkers is None:
+		nwalkers=max(4*npar,32)
+	nwalkers=nwalkers+nwalkers % 2
+	perr=np.array(p.perror[:,1],dtype=float)
+	scale=np.where(np.isfinite(perr) & (perr > 0) & (perr < abs(par)),perr,1e-3*abs(par))*0.1
+	scale=np.where(scale > 0,scale,1e-6)
+
+	rng=np.random.RandomState(seed)
+	try:
+		x,lp=mcmc.initial_ball(lnprob,par,scale,nwalkers,rng)
+	except ValueError:
+		print('No valid MCMC starting points, keeping covariance errors')
+		return p
+	chain,step,acceptance,tau,converged=mcmc.sample(lnprob,x,lp=lp,maxsteps=maxsteps,\
+		seed=rng.randint(2**31),verbose=verbose)
+	if not converged:
+		print('MCMC did not converge in '+str(maxsteps)+' steps (tau = '+str(np.round(tau,1))+')')
+	samples=mcmc.thin_chain(chain,tau,maxsamples=maxsamples,step=step)
+
+	q=np.percentile(samples,[15.865,50.,84.135],axis=0)
+	m=fit_params(p.model,p.pnames,p.par,q[1]-q[0],q[2]-q[1],p.chisq,p.dof)
+	## the best fit's covariance (used by model_bands), evaluation count and
+	## convergence status
+	for a in ('pcov','nfev','success','message'):
+		if hasattr(p,a):
+			setattr(m,a,getattr(p,a))
+	m.samples=samples
+	m.tau=tau
+	m.acceptance=acceptance
+	m.converged=converged
+
+	return m
+
+## exceptions of a fit that did not converge or hit bad parameter values,
+## anything else (e.g. batch_fit's timeout) is passed on
+fit_failures=(RuntimeError,ValueError,np.linalg.LinAlgError)
+
+_boot=None
+
+def _set_boot(args):
+	global _boot
+	_boot=args
+
+def _bootstrap_one(i):
+
+	## refit of the i-th perturbed light curve of the bootstrap set by
+	## _set_boot, seeded by (seed,i) so the result does not depend on the
+	## worker that runs it. Failed fits come back as None.
+
+	lc,model,par,seed,opts=_boot
+	rng=np.random.RandomState([seed,i])
+	try:
+		with np.errstate(all='ignore'):
+			q=fit_lc_model(perturb_lc(lc,rng,stat=opts['stat']),par,model,**opts)
+		if np.all(np.isfinite(q.par)):
+			return i,np.array(q.par,dtype=float)
+	except fit_failures:
+		pass
+	return i,None
+
+## the light curve columns the fitters use
+lc_columns=['Time','T_+ve','T_-ve','Rate','Ratepos','Rateneg','Type',
+	'CtsInSrc','BGInSrc','Exposure','CorrFact']
+
+def lc_arrays(lc):
+
+	## plain numpy copy of the lc_columns of lc (cheap to pickle to worker
+	## processes), masked values as nan
+
+	return dict((c,np.ma.filled(lc[c],np.nan) if hasattr(lc[c],'mask') else np.array(lc[c])) \
+		for c in lc_columns if c in lc.keys())
+
+def perturb_lc(lc,rng,stat='chisq'):
+
+	## copy of lc with each detected Rate drawn within its errors (Ratepos
+	## above, Rateneg below) and, for stat='cstat', the counts in the source
+	## region drawn from a Poisson distribution. Upper limits are kept.
+
+	d=lc_arrays(lc)
+	ul=np.array(['UL' in str(t) for t in d['Type']])
+	z=rng.randn(len(ul))
+	err=np.where(z >= 0,d['Ratepos'],-d['Rateneg'])
+	d['Rate']=np.where(ul,d['Rate'],d['Rate']+z*err)
+	if stat == 'cstat':
+		n,b,k=cash_counts(d)
+		d['CtsInSrc']=rng.poisson(np.maximum(n,0)).astype(float)
+
+	return d
+
+def bootstrap_errors(lc,p,stat='chisq',ulsigma=3.,cash_types=None,nboot=200,maxtime=None,\
+	nproc=None,seed=None,method='L-BFGS-B',solver='curve_fit',max_nfev=None,fit_time=None,\
+	verbose=False):
+
+	## errors of the fit p from refits to nboot perturbed copies of lc (see
+	## perturb_lc), each warm-started from p.par, on nproc processes (all
+	## cpus by default, 1 inside a worker process such as batch_fit's).
+	## maxtime - wall-time budget in seconds, refits still running then are
+	## dropped
+	## stat, ulsigma, cash_types, method, solver, max_nfev, fit_time - the
+	## options of fit_lc_model that gave p, used again for every refit
+	## returns a new fit_params with perror = par-16th & 84th-par percentiles
+	## of the refits, which are kept (float32) in samples. Also sets nboot
+	## and keeps pcov, nfev, success & message of p.
+
+	import multiprocessing
+
+	if seed is None:
+		seed=np.random.randint(2**31)
+	if nproc is None:
+		nproc=multiprocessing.cpu_count()
+	if multiprocessing.current_process().daemon:
+		nproc=1
+	par=np.array(p.par,dtype=float)
+	opts={'stat':stat,'ulsigma':ulsigma,'cash_types':cash_types,'method':method,'solver':solver,\
+		'max_nfev':max_nfev,'fit_time':fit_time}
+	args=(lc_arrays(lc),p.model,par,seed,opts)
+
+	t0=time.time()
+	if nproc > 1:
+		pool=multiprocessing.Pool(nproc,initializer=_set_boot,initargs=(args,))
+		results=pool.imap_unordered(_bootstrap_one,range(nboot))
+	else:
+		_set_boot(args)
+		pool=None
+		results=(_bootstrap_one(i) for i in range(nboot))
+
+	refits={}
+	try:
+		for i,q in results:
+			if q is not None:
+				refits[i]=q
+			if maxtime and (time.time()-t0 > maxtime):
+				break
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+
+	if verbose:
+		print(str(len(refits))+' refits in '+str(round(time.time()-t0,1))+' s')
+	if len(refits) < 2:
+		print('Bootstrap failed, keeping covariance errors')
+		return p
+
+	samples=np.array([refits[i] for i in sorted(refits.keys())])
+	q=np.percentile(samples,[15.865,84.135],axis=0)
+	b=fit_params(p.model,p.pnames,p.par,np.maximum(par-q[0],0),np.maximum(q[1]-par,0),p.chisq,p.dof)
+	## the best fit's covariance (used by model_bands), evaluation count and
+	## convergence status
+	for a in ('pcov','nfev','success','message'):
+		if hasattr(p,a):
+			setattr(b,a,getattr(p,a))
+	b.samples=samples.astype(np.float32)
+	b.nboot=len(samples)
+
+	return b
+
+def latin_hypercube(n,d,rng):
+
+	## n points in [0,1)^d with one point in each of n equal slices of
+	## every dimension
+
+	return (np.argsort(rng.rand(n,d),axis=0)+rng.rand(n,d))/n
+
+def multistart_points(lc,p0,f,nstarts,spread=0.3,rng=None):
+
+	## nstarts starting points for model f: p0 and nstarts-1 Latin
+	## hypercube draws of the break times and pulse times within spread dex
+	## of p0's (kept within the data and the breaks in order), the other
+	## parameters as in p0
+
+	if rng is None:
+		rng=np.random.RandomState()
+	p0=np.array(p0,dtype=float)
+	idx=list(range(2,f.ncont,2))
+	if f.numflares:
+		npp=len(fit_functions.pulse_models[f.pulse]['pnames'])
+		idx=idx+list(range(f.ncont+fit_functions.pulse_models[f.pulse]['time'],f.nump,npp))
+	idx=np.array(idx,dtype=int)
+
+	starts=np.tile(p0,(nstarts,1))
+	if (nstarts < 2) or (len(idx) == 0):
+		return starts
+
+	t0=np.min(np.asarray(lc['Time']+lc['T_-ve'],dtype=float))
+	t1=np.max(np.asarray(lc['Time']+lc['T_+ve'],dtype=float))
+	tp=np.clip(p0[idx],t0,t1)
+	u=latin_hypercube(nstarts-1,len(idx),rng)
+	t=tp*10**(spread*(2*u-1))
+	starts[1:,idx]=np.clip(t,np.minimum(t0,p0[idx]),np.maximum(t1,p0[idx]))
+	if f.ncont > 2:
+		starts[1:,2:f.ncont:2]=np.sort(starts[1:,2:f.ncont:2],axis=1)
+
+	return starts
+
+_multistart=None
+
+def _set_multistart(args):
+	global _multistart
+	_multistart=args
+
+def _multistart_one(i):
+
+	## local fit from the i-th starting point set by _set_multistart,
+	## failed fits come back as None
+
+	lc,model,starts,opts=_multistart
+	try:
+		with np.errstate(all='ignore'):
+			p=fit_lc_model(lc,starts[i],model,**opts)
+		if np.isfinite(p.chisq):
+			return i,p
+	except fit_failures:
+		pass
+	return i,None
+
+def multistart_fit(lc,p0,model,pnames=None,nstarts=16,spread=0.3,agree=3,rtol=1e-3,nproc=None,\
+	seed=None,errors='covar',verbose=False,**kwargs):
+
+	## fit model (a fit_models / fit_functions.models name) from nstarts
+	## starting points around p0 (multistart_points) on nproc processes (all
+	## cpus by default, 1 inside a worker process such as batch_fit's) and
+	## keep the best. Stops once agree fits reach the best statistic within
+	## rtol. kwargs are options of fit_lc_model (stat, solver, ...), the
+	## errors are only computed for the best fit.
+	## returns its fit_params with nstarts (local fits done) and
+	## start_chisq (statistic from each start, nan if not run or failed)
+
+	import multiprocessing
+
+	if pnames is None:
+		pnames=fit_functions.models[model].pnames
+	if nproc is None:
+		nproc=multiprocessing.cpu_count()
+	if multiprocessing.current_process().daemon:
+		nproc=1
+
+	rng=np.random.RandomState(seed)
+	starts=multistart_points(lc,p0,fit_functions.models['int'+model],nstarts,spread=spread,rng=rng)
+	opts=dict(kwargs)
+	opts['pnames']=pnames
+	args=(lc_arrays(lc),model,starts,opts)
+
+	if nproc > 1:
+		pool=multiprocessing.Pool(nproc,initializer=_set_multistart,initargs=(args,))
+		results=pool.imap_unordered(_multistart_one,range(nstarts))
+	else:
+		_set_multistart(args)
+		pool=None
+		results=(_multistart_one(i) for i in range(nstarts))
+
+	chisq=np.zeros(nstarts)+np.nan
+	best=None
+	try:
+		for i,p in results:
+			if p is None:
+				continue
+			chisq[i]=p.chisq
+			if (best is None) or (p.chisq < best.chisq):
+				best=p
+			if np.sum(chisq <= best.chisq*(1.+rtol)) >= agree:
+				break
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+
+	if best is None:
+		raise RuntimeError('No fit converged from '+str(nstarts)+' starting points')
+	if verbose:
+		print(str(np.sum(np.isfinite(chisq)))+' fits, chisq: '+str(np.round(chisq,1)))
+
+	if errors != 'covar':
+		best=fit_lc_model(lc,best.par,model,pnames=pnames,errors=errors,seed=seed,**kwargs)
+	best.nstarts=int(np.sum(np.isfinite(chisq)))
+	best.start_chisq=chisq
+
+	return best
+
+def fit_covariance(jac,chisq=None,dof=None):
+
+	## parameter covariance from the jacobian of the normalized residuals at
+	## the best fit. Scaled by the reduced chisq as curve_fit does if chisq
+	## is given. The columns are normalized first so parameters of very
+	## different scales (e.g. norm & pows in a log space fit) are kept.
+
+	d=np.sqrt(np.sum(jac**2,axis=0))
+	d=np.where(d > 0,d,1.)
+	u,s,vt=np.linalg.svd(jac/d,full_matrices=False)
+	keep=s > np.finfo(float).eps*max(jac.shape)*s[0]
+	vt=vt[keep]
+	pcov=np.dot(vt.T/s[keep]**2,vt)/np.outer(d,d)
+	if chisq is None:
+		return pcov
+	if dof > 0:
+		pcov=pcov*chisq/dof
+	else:
+		pcov[:]=np.inf
+
+	return pcov
+
+_grid_lc=None
+_grid_pulse='gauss'
+
+def _set_grid_lc(lc,pulse='gauss'):
+	global _grid_lc,_grid_pulse
+	_grid_lc=lc
+	_grid_pulse=pulse
+
+def _fit_candidate(c):
+
+	## fit one (numflares,numbreaks) candidate to the light curve set by
+	## _set_grid_lc, failed fits come back as status 'error'
+
+	numflares,numbreaks=c
+	try:
+		p0,model,fmodel,pnames=auto_initial_conditions(lc=_grid_lc,numflares=numflares,\
+			numbreaks=numbreaks,pulse=_grid_pulse)
+		p=fit_lc_model(_grid_lc,p0,model,fmodel=fmodel,pnames=pnames)
+		if not np.isfinite(p.chisq):
+			return c,'error',None
+		return c,'ok',p
+	except fit_failures:
+		return c,'error',None
+
+def compare_models(grbdict=None,lc=None,maxflares=3,maxbreaks=4,criterion='bic',alpha=0.01,\
+	nproc=None,verbose=True,pulse='gauss'):
+
+	## fit a grid of numflares x numbreaks models to one light curve and pick
+	## the best by criterion ('aic', 'bic' or nested 'ftest'), with flares
+	## modelled by pulse ('gauss' or 'norris').
+	## Candidates are fitted concurrently in order of complexity on nproc
+	## processes (all cpus by default, 1 inside a worker process such as
+	## batch_fit's). A model is only extended (one more flare or break) if
+	## it beat the simpler model it extends, so dominated branches of the
+	## grid are never fitted.
+	## returns the winning fit_params and the comparison table
+
+	import multiprocessing
+	from scipy.stats import f as fdist
+
+	if grbdict:
+		lc=grbdict.lc
+
+	## preprocess once, workers get the plain arrays when they start
+	lcarr={}
+	for c in ['Time','T_+ve','T_-ve','Rate','Ratepos','Rateneg','Type']:
+		if c in lc.keys():
+			lcarr[c]=np.array(lc[c])
+	n=len(lcarr['Rate'])
+
+	if nproc is None:
+		nproc=multiprocessing.cpu_count()
+	if multiprocessing.current_process().daemon:
+		nproc=1
+	if nproc > 1:
+		pool=multiprocessing.Pool(nproc,initializer=_set_grid_lc,initargs=(lcarr,pulse))
+		fmap=pool.map
+	else:
+		_set_grid_lc(lcarr,pulse)
+		pool=None
+		fmap=map
+
+	fits={}
+	accepted={}
+	pvalue={}
+	level=[(0,0)]
+	try:
+		while level:
+			for c,status,p in fmap(_fit_candidate,level):
+				fits[c]=p
+				pvalue[c]=np.nan
+				accepted[c]=False
+				if status != 'ok':
+					continue
+				k=len(p.par)
+				p.aic=p.chisq+2*k
+				p.bic=p.chisq+k*np.log(n)
+				parents=[q for q in [(c[0]-1,c[1]),(c[0],c[1]-1)] if fits.get(q)]
+				if not parents:
+					accepted[c]=True
+					continue
+				best=min(parents,key=lambda q: fits[q].chisq)
+				pp=fits[best]
+				dk=k-len(pp.par)
+				if (p.chisq < pp.chisq) & (p.dof > 0):
+					pvalue[c]=fdist.sf((pp.chisq-p.chisq)/dk/(p.chisq/p.dof),dk,p.dof)
+				if criterion == 'ftest':
+					accepted[c]=pvalue[c] < alpha
+				else:
+					accepted[c]=getattr(p,criterion) < min([getattr(fits[q],criterion) for q in parents])
+
+			## next level: extend accepted models by one flare or one break
+			nxt=[]
+			for c in level:
+				if not accepted[c]:
+					continue
+				for q in [(c[0]+1,c[1]),(c[0],c[1]+1)]:
+					if (q[0] <= maxflares) & (q[1] <= maxbreaks) & (q not in fits) & (q not in nxt):
+						nxt.append(q)
+			level=nxt
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+
+	names=[]
+	rows=[]
+	for c in sorted(fits.keys(),key=lambda q: (q[0]+q[1],q)):
+		p=fits[c]
+		names.append(fit_functions.model_name(c[0],c[1],pulse=pulse))
+		if p:
+			rows.append((c[0],c[1],len(p.par),p.chisq,p.dof,p.aic,p.bic,pvalue[c],accepted[c]))
+		else:
+			rows.append((c[0],c[1],0,np.nan,np.nan,np.nan,np.nan,np.nan,False))
+	rows=np.array(rows,dtype=[('numflares',int),('numbreaks',int),('nump',int),('chisq',float),\
+		('dof',float),('aic',float),('bic',float),('ftest_p',float),('accepted',bool)])
+	table=Table(rows)
+	table.add_column(Column(names,name='model'),index=0)
+
+	ok=[c for c in fits if fits[c]]
+	if not ok:
+		print('No model could be fitted')
+		return 0,table
+	if criterion == 'ftest':
+		## models reached by a chain of significant F-tests, non-nested
+		## survivors are ranked by reduced chisq
+		win=min([c for c in ok if accepted[c]],key=lambda q: fits[q].chisq/fits[q].dof)
+	else:
+		win=min(ok,key=lambda q: getattr(fits[q],criterion))
+	table.add_column(Column([(r['numflares'],r['numbreaks']) == win for r in table],name='best'))
+
+	if verbose:
+		print(table)
+		print('Best model ('+criterion+'): '+fits[win].model)
+
+	return fits[win],table
+
 def lc_linfit(x,y,breaks):
 
 	bks=np.hstack((min(x)-1,breaks,max(x)))
@@ -75,6 +971,7 @@ def lc_linfit(x,y,breaks):
 		pnames=np.hstack((pnames,'pow'+str(i+1),'break'+str(i+1)))
 
 	p=p[0:len(p)-1]
+	pnames=pnames[0:len(pnames)-1]
 	return p,yfit,pnames
 
 def click_initial_conditions(dir=None,lc=None):
@@ -121,6 +1018,216 @@ def click_initial_conditions(dir=None,lc=None):
 
 	## plot again with crude fits
 
+def segmented_linfit(x,y,w,numbreaks=None,maxbreaks=4,ncand=40,minpts=3,minspan=0.5,maxrise=0.):
+
+	## weighted piecewise-linear fit of y(x) (log-log light curve) with the
+	## best breaks chosen by dynamic programming over ncand candidate break
+	## positions. Segment chisq for every candidate pair comes from prefix
+	## sums, so there is no loop over data points. Segments must span at
+	## least minspan in x (dex) and only the first may rise faster than
+	## maxrise (by default no later one rises), so breaks can't chase a
+	## flare's rise and decay. If numbreaks
+	## is None the number of breaks (<= maxbreaks) is chosen by BIC.
+	## returns break positions, slopes, intercepts and the fitted y
+
+	n=len(x)
+	cand=np.unique(np.linspace(0,n,min(ncand,n)+1).astype(int))
+	k=len(cand)
+
+	## centre the data so the prefix-sum chisq doesn't lose precision
+	xm=np.sum(w*x)/np.sum(w)
+	ym=np.sum(w*y)/np.sum(w)
+	x=x-xm
+	y=y-ym
+	s=np.vstack((w,w*x,w*y,w*x*x,w*x*y,w*y*y)).T
+	s=np.vstack((np.zeros(6),np.cumsum(s,axis=0)))
+	d=s[cand][np.newaxis,:,:]-s[cand][:,np.newaxis,:]
+	sw,sx,sy,sxx,sxy,syy=[d[:,:,i] for i in range(6)]
+
+	with np.errstate(divide='ignore',invalid='ignore'):
+		m=(sw*sxy-sx*sy)/(sw*sxx-sx**2)
+		b=(sy-m*sx)/sw
+		cost=syy-2*m*sxy-2*b*sy+m**2*sxx+2*m*b*sx+b**2*sw
+		rise=m > maxrise
+	npts=cand[np.newaxis,:]-cand[:,np.newaxis]
+	xc=np.hstack((x,x[-1]))[cand]
+	span=xc[np.newaxis,:]-xc[:,np.newaxis]
+	span[:,-1]=np.inf
+	span[0,:]=np.inf
+	rise[0,:]=False
+	cost[(npts < minpts) | (span < minspan) | rise | ~np.isfinite(cost)]=np.inf
+
+	if numbreaks is None:
+		nbmax=maxbreaks
+	else:
+		nbmax=numbreaks
+	nbmax=max(min(nbmax,n//minpts-1),0)
+
+	## best[j,c] = chisq of the best fit of points [0,cand[c]) with j breaks
+	best=np.empty((nbmax+1,k))
+	prev=np.zeros((nbmax+1,k),dtype=int)
+	best[0]=cost[0]
+	for j in range(1,nbmax+1):
+		tot=best[j-1][:,np.newaxis]+cost
+		prev[j]=np.argmin(tot,axis=0)
+		best[j]=tot[prev[j],np.arange(k)]
+
+	if numbreaks is None:
+		bic=best[:,-1]+(2+2*np.arange(nbmax+1))*np.log(n)
+		nb=int(np.argmin(bic))
+	else:
+		nb=nbmax
+
+	ci=[k-1]
+	for j in range(nb,0,-1):
+		ci.insert(0,prev[j][ci[0]])
+	ci=np.array([0]+ci)
+	edges=cand[ci]
+
+	slopes=m[ci[:-1],ci[1:]]
+	intercepts=b[ci[:-1],ci[1:]]-slopes*xm+ym
+	breaks=(x[edges[1:-1]-1]+x[edges[1:-1]])/2.+xm
+	seg=np.searchsorted(edges[1:-1],np.arange(n),side='right')
+	yfit=intercepts[seg]+slopes[seg]*(x+xm)
+
+	return breaks,slopes,intercepts,yfit
+
+def find_flares(t,y,err,cont,nsigma=5.,maxflares=6,minpts=3):
+
+	## flare candidates from runs of at least minpts points more than 1 sigma
+	## above the continuum cont, with a combined significance above nsigma
+	## returns an (nflares,3) array of gauss norm, center, width and a
+	## boolean mask of the points within 3 widths of a flare
+
+	sig=(y-cont)/err
+	above=np.hstack((False,sig > 1.,False)).astype(int)
+	edge=np.diff(above)
+	start=np.where(edge == 1)[0]
+	stop=np.where(edge == -1)[0]
+
+	flares=[]
+	score=[]
+	mask=np.zeros(len(t),dtype=bool)
+	for i0,i1 in zip(start,stop):
+		if (i1-i0 < minpts) or (np.sum(sig[i0:i1])/np.sqrt(i1-i0) < nsigma):
+			continue
+		ipk=i0+np.argmax(y[i0:i1]-cont[i0:i1])
+		width=max((t[i1-1]-t[i0])/4.,(t[min(i1,len(t)-1)]-t[max(i0-1,0)])/8.)
+		flares.append([y[ipk]-cont[ipk],t[ipk],width])
+		score.append(np.sum(sig[i0:i1]))
+		mask[i0:i1]=True
+		mask[abs(t-t[ipk]) < 3*width]=True
+
+	flares=np.array(flares).reshape(-1,3)
+	if len(flares) > maxflares:
+		keep=np.sort(np.argsort(score)[::-1][0:maxflares])
+		flares=flares[keep]
+
+	return flares,mask
+
+def continuum_flares(t,y,err,numbreaks=None,maxbreaks=4,numflares=None,maxflares=6,nsigma=5.,niter=3):
+
+	## broken power law continuum (segmented_linfit in log-log) and flares
+	## (find_flares) of a sorted light curve, refitting the continuum
+	## without the flares' points niter times. numflares forces the number
+	## of flares (maxflares is then numflares). The flare norms are then
+	## refitted with the continuum, widths and centers fixed (non-negative
+	## linear least squares).
+	## returns log10 breaks, slopes, intercepts, the continuum, flares
+	## (norm, center, width), the flare mask and the chisq of the guess
+
+	logt=np.log10(t)
+	logy=np.log10(y)
+	w=(y/err*np.log(10.))**2
+
+	mask=np.zeros(len(t),dtype=bool)
+	flares=np.zeros((0,3))
+	for i in range(niter):
+		breaks,slopes,intercepts,yfit=segmented_linfit(logt[~mask],logy[~mask],w[~mask],\
+			numbreaks=numbreaks,maxbreaks=maxbreaks)
+		seg=np.searchsorted(breaks,logt,side='right')
+		cont=10**(intercepts[seg]+slopes[seg]*logt)
+		if maxflares == 0:
+			break
+		flares,mask=find_flares(t,y,err,cont,nsigma=nsigma,maxflares=maxflares)
+		if not np.any(mask):
+			break
+
+	## forced number of flares: pad with the most significant remaining
+	## runs of positive residuals, then the largest single residuals
+	if (numflares is not None) and (len(flares) < numflares):
+		extra,m=find_flares(t,np.where(mask,cont,y),err,cont,nsigma=0.,\
+			maxflares=numflares-len(flares),minpts=1)
+		flares=np.vstack((flares,extra))
+		mask=mask | m
+		resid=(y-cont)/err
+		resid[mask]=-np.inf
+		for j in np.argsort(resid)[::-1][0:numflares-len(flares)]:
+			flares=np.vstack((flares,[max(y[j]-cont[j],err[j]),t[j],t[j]/10.]))
+		flares=flares[np.argsort(flares[:,1])]
+
+	r=(y-cont)/err
+	if len(flares):
+		a=np.exp(-(t[:,np.newaxis]-flares[:,1])**2/(2.*flares[:,2]**2))/err[:,np.newaxis]
+		norm,rnorm=nnls(a,r)
+		flares[:,0]=np.where(norm > 0,norm,flares[:,0])
+		chisq=rnorm**2
+	else:
+		chisq=np.sum(r**2)
+
+	return breaks,slopes,intercepts,cont,flares,mask,chisq
+
+def auto_initial_conditions(dir=None,lc=None,numflares=None,numbreaks=None,maxflares=6,\
+	maxbreaks=4,nsigma=5.,niter=3,pulse='gauss'):
+
+	## algorithmic replacement for click_initial_conditions, no plots or prompts
+	## breaks from a segmented log-log fit, flares from significant positive
+	## residuals (continuum_flares). numflares/numbreaks force the number of
+	## each (None = choose, the number of breaks by the BIC of the
+	## continuum with the flares found on it)
+	## pulse - flare model, gaussian guesses are converted by its 'guess'
+	## returns the same (p0,model,fmodel,pnames) as click_initial_conditions
+
+	if dir != None:
+		lc=read_lc(dir=dir)
+
+	t=np.array(lc['Time'],dtype=float)
+	y=np.array(lc['Rate'],dtype=float)
+	err=np.array(lc['Ratepos'],dtype=float)
+	good=(y > 0) & (err > 0) & (t > 0)
+	if 'Type' in lc.keys():
+		good=good & np.array(['UL' not in s for s in lc['Type']])
+	s=np.argsort(t[good])
+	t=t[good][s]
+	y=y[good][s]
+	err=err[good][s]
+
+	if numflares == 0:
+		maxflares=0
+	elif numflares is not None:
+		maxflares=numflares
+
+	if (numbreaks is None) and (maxflares > 0):
+		## breaks can absorb flares, so the number of breaks is chosen
+		## together with the flares found on each continuum, by BIC
+		fits=[continuum_flares(t,y,err,nb,numflares=numflares,maxflares=maxflares,nsigma=nsigma,\
+			niter=niter) for nb in range(maxbreaks+1)]
+		bic=[f[-1]+(2+2*len(f[0])+3*len(f[4]))*np.log(len(t)) for f in fits]
+		breaks,slopes,intercepts,cont,flares,mask,chisq=fits[int(np.argmin(bic))]
+	else:
+		breaks,slopes,intercepts,cont,flares,mask,chisq=continuum_flares(t,y,err,numbreaks,\
+			maxbreaks=maxbreaks,numflares=numflares,maxflares=maxflares,nsigma=nsigma,niter=niter)
+
+	p=np.hstack((10**intercepts[0],-slopes[0]))
+	for i in range(len(breaks)):
+		p=np.hstack((p,10**breaks[i],-slopes[i+1]))
+	p=np.hstack((p,fit_functions.pulse_models[pulse]['guess'](flares).ravel()))
+
+	model,fmodel=fit_models(len(flares),len(breaks),norris=(pulse == 'norris'))
+	pnames=fmodel[model].pnames
+
+	return p,model,fmodel,pnames
+
 class Click:
 
 	def __init__(self, fig=None):
@@ -222,210 +1329,70 @@ def initial_guess(dir=None,lc=None,flares=False,breaks=False):
 
 def fit_models(numflares,numbreaks,norris=False):
 
-	## norm + numflares*3 + numbreaks*2-1
-	nump=1 + numflares*3 + numbreaks*2-1
-	if numbreaks == 0: nump=nump+2
+	## model name for numflares pulses on a power law with numbreaks breaks
+	## models are built on demand by fit_functions.build_model, so
+	## fmodel[model] and fmodel['int'+model] work for any number of each
 
 	if norris:
 		g='norris'
 	else:
 		g='gauss'
 
-	if nump == 2: model='pow'
-	if nump == 4: model='bknpow'
-	if nump == 5: model=g+'1_pow'
-	if nump == 6: model='bkn2pow'
-	if nump == 7: model=g+'1_bknpow'
-	if nump == 8: 
-		model='bkn3pow'
-		if numflares == 2: model=g+'2_pow'
-	if nump == 9: model=g+'1_bkn2pow'
-	if nump == 10:
-		model='bkn4pow'
-		if numflares == 2: model=g+'2_bknpow'
-	if nump == 11:
-		if numflares == 3: model=g+'3_pow'
-		if numflares == 1: model=g+'1_bkn3pow'
-	if nump == 12: model=g+'2_bkn2pow'
-	if nump == 13: 
-		if numflares == 3: model=g+'3_bknpow'
-		if numflares == 1: model=g+'1_bkn4pow'
-	if nump == 14: 
-		if numflares == 4: model=g+'4_pow'
-		if numflares == 2: model=g+'2_bkn3pow'
-	if nump == 15: model=g+'3_bkn2pow'
-	if nump == 16:  
-		if numflares == 4: model=g+'4_bknpow'
-		if numflares == 2: model=g+'2_bkn4pow'
-	if nump == 17:  
-		if numflares == 5: model=g+'5_pow'
-		if numflares == 3: model=g+'3_bkn3pow'
-	if nump == 18: model=g+'4_bkn2pow'
-	if nump == 19:  
-		if numflares == 5: model=g+'5_bknpow'
-		if numflares == 3: model=g+'3_bkn4pow'
-	if nump == 20:  
-		if numflares == 6: model=g+'6_pow'
-		if numflares == 4: model=g+'4_bkn3pow'
-	if nump == 21: model=g+'5_bkn2pow'
-	if nump == 22:  
-		if numflares == 6: model=g+'6_bknpow'
-		if numflares == 4: model=g+'4_bkn4pow'
-	if nump == 23:  
-		if numflares == 7: model=g+'7_pow'
-		if numflares == 5: model=g+'5_bkn3pow'
-	if nump == 24: model=g+'6_bkn2pow'
-	if nump == 25:  
-		if numflares == 7: model=g+'7_bknpow'
-		if numflares == 5: model=g+'5_bkn4pow'
-	if nump == 26: model=g+'6_bkn3pow'
-	if nump == 27: model=g+'7_bkn2pow'
-	if nump == 28: model=g+'6_bkn4pow'
-	if nump == 29: model=g+'7_bkn3pow'
-	if nump == 31: model=g+'7_bkn4pow'
-
-	function_model={
-		'gauss': fit_functions.gauss,
-		# 'norris': fit_functions.norris,
-		'pow': fit_functions.pow,
-		'gauss1_pow': fit_functions.gauss1_pow,
-		'gauss2_pow': fit_functions.gauss2_pow,
-		'gauss3_pow': fit_functions.gauss3_pow,
-		'gauss4_pow': fit_functions.gauss4_pow,
-		'gauss5_pow': fit_functions.gauss5_pow,
-		'gauss6_pow': fit_functions.gauss6_pow,
-		# 'norris1_pow': fit_functions.norris1_pow,
-		# 'norris2_pow': fit_functions.norris2_pow,
-		# 'norris3_pow': fit_functions.norris3_pow,
-		# 'norris4_pow': fit_functions.norris4_pow,
-		# 'norris5_pow': fit_functions.norris5_pow,
-		# 'norris6_pow': fit_functions.norris6_pow,
-		'bknpow': fit_functions.bknpow,
-		'gauss1_bknpow': fit_functions.gauss1_bknpow,
-		'gauss2_bknpow': fit_functions.gauss2_bknpow,
-		'gauss3_bknpow': fit_functions.gauss3_bknpow,
-		'gauss4_bknpow': fit_functions.gauss4_bknpow,
-		'gauss5_bknpow': fit_functions.gauss5_bknpow,
-		'gauss6_bknpow': fit_functions.gauss6_bknpow,
-		# 'norris1_bknpow': fit_functions.norris1_bknpow,
-		# 'norris2_bknpow': fit_functions.norris2_bknpow,
-		# 'norris3_bknpow': fit_functions.norris3_bknpow,
-		# 'norris4_bknpow': fit_functions.norris4_bknpow,
-		# 'norris5_bknpow': fit_functions.norris5_bknpow,
-		# 'norris6_bknpow': fit_functions.norris6_bknpow,
-		'bkn2pow': fit_functions.bkn2pow,
-		'gauss1_bkn2pow': fit_functions.gauss1_bkn2pow,
-		'gauss2_bkn2pow': fit_functions.gauss2_bkn2pow,
-		'gauss3_bkn2pow': fit_functions.gauss3_bkn2pow,
-		'gauss4_bkn2pow': fit_functions.gauss4_bkn2pow,
-		'gauss5_bkn2pow': fit_functions.gauss5_bkn2pow,
-		'gauss6_bkn2pow': fit_functions.gauss6_bkn2pow,
-		# 'norris1_bkn2pow': fit_functions.norris1_bkn2pow,
-		# 'norris2_bkn2pow': fit_functions.norris2_bkn2pow,
-		# 'norris3_bkn2pow': fit_functions.norris3_bkn2pow,
-		# 'norris4_bkn2pow': fit_functions.norris4_bkn2pow,
-		# 'norris5_bkn2pow': fit_functions.norris5_bkn2pow,
-		# 'norris6_bkn2pow': fit_functions.norris6_bkn2pow,
-		'bkn3pow': fit_functions.bkn3pow,
-		'gauss1_bkn3pow': fit_functions.gauss1_bkn3pow,
-		'gauss2_bkn3pow': fit_functions.gauss2_bkn3pow,
-		'gauss3_bkn3pow': fit_functions.gauss3_bkn3pow,
-		'gauss4_bkn3pow': fit_functions.gauss4_bkn3pow,
-		'gauss5_bkn3pow': fit_functions.gauss5_bkn3pow,
-		'gauss6_bkn3pow': fit_functions.gauss6_bkn3pow,
-		# 'norris1_bkn3pow': fit_functions.norris1_bkn3pow,
-		# 'norris2_bkn3pow': fit_functions.norris2_bkn3pow,
-		# 'norris3_bkn3pow': fit_functions.norris3_bkn3pow,
-		# 'norris4_bkn3pow': fit_functions.norris4_bkn3pow,
-		# 'norris5_bkn3pow': fit_functions.norris5_bkn3pow,
-		# 'norris6_bkn3pow': fit_functions.norris6_bkn3pow,
-		'bkn4pow': fit_functions.bkn4pow,
-		'gauss1_bkn4pow': fit_functions.gauss1_bkn4pow,
-		'gauss2_bkn4pow': fit_functions.gauss2_bkn4pow,
-		'gauss3_bkn4pow': fit_functions.gauss3_bkn4pow,
-		'gauss4_bkn4pow': fit_functions.gauss4_bkn4pow,
-		'gauss5_bkn4pow': fit_functions.gauss5_bkn4pow,
-		'gauss6_bkn4pow': fit_functions.gauss6_bkn4pow,
-		# 'norris1_bkn4pow': fit_functions.norris1_bkn4pow,
-		# 'norris2_bkn4pow': fit_functions.norris2_bkn4pow,
-		# 'norris3_bkn4pow': fit_functions.norris3_bkn4pow,
-		# 'norris4_bkn4pow': fit_functions.norris4_bkn4pow,
-		# 'norris5_bkn4pow': fit_functions.norris5_bkn4pow,
-		# 'norris6_bkn4pow': fit_functions.norris6_bkn4pow,
-		### integral functions
-		'intgauss': fit_functions.gauss,
-		'intpow': fit_functions.intpow,
-		'intgauss1_pow': fit_functions.intgauss1_pow,
-		'intgauss2_pow': fit_functions.intgauss2_pow,
-		'intgauss3_pow': fit_functions.intgauss3_pow,
-		'intgauss4_pow': fit_functions.intgauss4_pow,
-		'intgauss5_pow': fit_functions.intgauss5_pow,
-		'intgauss6_pow': fit_functions.intgauss6_pow,
-		# 'intnorris1_pow': fit_functions.intnorris1_pow,
-		# 'intnorris2_pow': fit_functions.intnorris2_pow,
-		# 'intnorris3_pow': fit_functions.intnorris3_pow,
-		# 'intnorris4_pow': fit_functions.intnorris4_pow,
-		# 'intnorris5_pow': fit_functions.intnorris5_pow,
-		# 'intnorris6_pow': fit_functions.intnorris6_pow,
-		'intbknpow': fit_functions.intbknpow,
-		'intgauss1_bknpow': fit_functions.intgauss1_bknpow,
-		'intgauss2_bknpow': fit_functions.intgauss2_bknpow,
-		'intgauss3_bknpow': fit_functions.intgauss3_bknpow,
-		'intgauss4_bknpow': fit_functions.intgauss4_bknpow,
-		'intgauss5_bknpow': fit_functions.intgauss5_bknpow,
-		'intgauss6_bknpow': fit_functions.intgauss6_bknpow,
-		# 'intnorris1_bknpow': fit_functions.intnorris1_bknpow,
-		# 'intnorris2_bknpow': fit_functions.intnorris2_bknpow,
-		# 'intnorris3_bknpow': fit_functions.intnorris3_bknpow,
-		# 'intnorris4_bknpow': fit_functions.intnorris4_bknpow,
-		# 'intnorris5_bknpow': fit_functions.intnorris5_bknpow,
-		# 'intnorris6_bknpow': fit_functions.intnorris6_bknpow,
-		'intbkn2pow': fit_functions.intbkn2pow,
-		'intgauss1_bkn2pow': fit_functions.intgauss1_bkn2pow,
-		'intgauss2_bkn2pow': fit_functions.intgauss2_bkn2pow,
-		'intgauss3_bkn2pow': fit_functions.intgauss3_bkn2pow,
-		'intgauss4_bkn2pow': fit_functions.intgauss4_bkn2pow,
-		'intgauss5_bkn2pow': fit_functions.intgauss5_bkn2pow,
-		'intgauss6_bkn2pow': fit_functions.intgauss6_bkn2pow,
-		# 'intnorris1_bkn2pow': fit_functions.intnorris1_bkn2pow,
-		# 'intnorris2_bkn2pow': fit_functions.intnorris2_bkn2pow,
-		# 'intnorris3_bkn2pow': fit_functions.intnorris3_bkn2pow,
-		# 'intnorris4_bkn2pow': fit_functions.intnorris4_bkn2pow,
-		# 'intnorris5_bkn2pow': fit_functions.intnorris5_bkn2pow,
-		# 'intnorris6_bkn2pow': fit_functions.intnorris6_bkn2pow,
-		'intbkn3pow': fit_functions.intbkn3pow,
-		'intgauss1_bkn3pow': fit_functions.intgauss1_bkn3pow,
-		'intgauss2_bkn3pow': fit_functions.intgauss2_bkn3pow,
-		'intgauss3_bkn3pow': fit_functions.intgauss3_bkn3pow,
-		'intgauss4_bkn3pow': fit_functions.intgauss4_bkn3pow,
-		'intgauss5_bkn3pow': fit_functions.intgauss5_bkn3pow,
-		'intgauss6_bkn3pow': fit_functions.intgauss6_bkn3pow,
-		# 'intnorris1_bkn3pow': fit_functions.intnorris1_bkn3pow,
-		# 'intnorris2_bkn3pow': fit_functions.intnorris2_bkn3pow,
-		# 'intnorris3_bkn3pow': fit_functions.intnorris3_bkn3pow,
-		# 'intnorris4_bkn3pow': fit_functions.intnorris4_bkn3pow,
-		# 'intnorris5_bkn3pow': fit_functions.intnorris5_bkn3pow,
-		# 'intnorris6_bkn3pow': fit_functions.intnorris6_bkn3pow,
-		'intbkn4pow': fit_functions.intbkn4pow,
-		'intgauss1_bkn4pow': fit_functions.intgauss1_bkn4pow,
-		'intgauss2_bkn4pow': fit_functions.intgauss2_bkn4pow,
-		'intgauss3_bkn4pow': fit_functions.intgauss3_bkn4pow,
-		'intgauss4_bkn4pow': fit_functions.intgauss4_bkn4pow,
-		'intgauss5_bkn4pow': fit_functions.intgauss5_bkn4pow,
-		'intgauss6_bkn4pow': fit_functions.intgauss6_bkn4pow,
-		# 'intnorris1_bkn4pow': fit_functions.intnorris1_bkn4pow,
-		# 'intnorris2_bkn4pow': fit_functions.intnorris2_bkn4pow,
-		# 'intnorris3_bkn4pow': fit_functions.intnorris3_bkn4pow,
-		# 'intnorris4_bkn4pow': fit_functions.intnorris4_bkn4pow,
-		# 'intnorris5_bkn4pow': fit_functions.intnorris5_bkn4pow,
-		# 'intnorris6_bkn4pow': fit_functions.intnorris6_bkn4pow,
-	}
-
-	return model,function_model#[model]
-
-def plot_lcfit(grbdict=None,lc=None,p=None,resid=True,noshow=False):
+	model=fit_functions.model_name(numflares,numbreaks,pulse=g)
+
+	return model,fit_functions.models
+
+def model_draws(p,ndraw=500,seed=None):
+
+	## up to ndraw parameter sets spread like the uncertainty of fit p: its
+	## MCMC or bootstrap samples if it has them, otherwise draws from a
+	## gaussian with its covariance matrix (pcov) or, for fits read back
+	## without one, its independent symmetrized errors.
+
+	rng=np.random.RandomState(seed)
+	par=np.array(p.par,dtype=float)
+
+	samples=getattr(p,'samples',None)
+	if (samples is not None) and len(samples):
+		samples=np.asarray(samples,dtype=float)
+		if len(samples) > ndraw:
+			samples=samples[rng.choice(len(samples),ndraw,replace=False)]
+		return samples
+
+	pcov=getattr(p,'pcov',None)
+	if pcov is None:
+		pcov=np.diag(np.mean(np.asarray(p.perror,dtype=float),axis=1)**2)
+	pcov=np.array(pcov,dtype=float)
+	## parameters with undefined errors are held at the best fit
+	bad=~np.isfinite(np.diag(pcov))
+	pcov[bad,:]=0.
+	pcov[:,bad]=0.
+	pcov[~np.isfinite(pcov)]=0.
+
+	return rng.multivariate_normal(par,pcov,size=ndraw)
+
+def model_bands(p,t,levels=(68.27,95.45),ndraw=500,fmodel=None,seed=None):
+
+	## central confidence bands of model p at times t from model_draws,
+	## all evaluated in one call (fit_functions.evaluate)
+	## returns (len(levels),2,len(t)) lower & upper percentiles
+
+	if fmodel is None:
+		fmodel=fit_functions.models
+	draws=model_draws(p,ndraw=ndraw,seed=seed)
+	with np.errstate(all='ignore'):
+		y=fmodel[p.model].evaluate(np.asarray(t,dtype=float),draws)
+	q=[]
+	for l in levels:
+		q=q+[50.-l/2.,50.+l/2.]
+
+	return np.nanpercentile(y,q,axis=0).reshape(len(levels),2,len(t))
+
+def plot_lcfit(grbdict=None,lc=None,p=None,resid=True,noshow=False,bands=False,ndraw=500,nt=300):
 
 ### if no p, plot without
+### bands - shade the 68 & 95% confidence bands of the model (model_bands
+###         from ndraw parameter sets, on nt log-spaced times)
 
 	if grbdict:
 		lc=grbdict.lc
@@ -466,7 +1433,7 @@ def plot_lcfit(grbdict=None,lc=None,p=None,resid=True,noshow=False):
 
 			if p:
 				if resid: 
-					yfit=fit_functions.call_function(p.model,lc['Time'][w],p)
+					yfit=fit_functions.call_function(p.model,lc['Time'][w],*p.par)
 					res=lc['Rate'][w]/yfit
 					ax2.errorbar(lc['Time'][w],res,xerr=[-lc['T_-ve'][w],lc['T_+ve'][w]],\
 						yerr=yerr/yfit,linestyle='None',capsize=0,fmt='none',ecolor=color[t],\
@@ -477,8 +1444,13 @@ def plot_lcfit(grbdict=None,lc=None,p=None,resid=True,noshow=False):
 	if p:
 		print(p.model)
 #		yfit=getattr(importlib.import_module('fit_functions'),p.model)(lc['Time'],p.par)
-		yfit=fit_functions.call_function(p.model,lc['Time'],p)
+		yfit=fit_functions.call_function(p.model,lc['Time'],*p.par)
 		ax1.plot(lc['Time'],yfit,color='green')
+		if bands:
+			tb=np.logspace(np.log10(min(lc['Time']+lc['T_-ve'])),np.log10(max(lc['Time']+lc['T_+ve'])),nt)
+			band=model_bands(p,tb,ndraw=ndraw)
+			for b,alpha in zip(band,(0.4,0.2)):
+				ax1.fill_between(tb,b[0],b[1],color='green',alpha=alpha,linewidth=0)
 
 		
 	ax1.legend(loc="upper right")
@@ -535,123 +1507,225 @@ def read_lcfit(dir='',file=''):
 
 		nump=len(par)
 		nf=len([p for p in pnames if 'g' in p])
+		nb=(nump-3*nf-2)//2
 		model='nofit'
-		if nump == 2: model='pow'
-		if nump == 4: model='bknpow'
-		if nump == 5: model='gauss1_pow'
-		if nump == 6: model='bkn2pow'
-		if nump == 7: model='gauss1_bknpow'
-		if nump == 8: 
-			model='bkn3pow'
-			if nf == 2: model='gauss2_pow'
-		if nump == 9: model='gauss1_bkn2pow'
-		if nump == 10:
-			model='bkn4pow'
-			if nf == 2: model='gauss2_bknpow'
-		if nump == 11:
-			if nf == 3: model='gauss3_pow'
-			if nf == 1: model='gauss1_bkn3pow'
-		if nump == 12: model='gauss2_bkn2pow'
-		if nump == 13: 
-			if nf == 3: model='gauss3_bknpow'
-			if nf == 1: model='gauss1_bkn4pow'
-		if nump == 14: 
-			if nf == 4: model='gauss4_pow'
-			if nf == 2: model='gauss2_bkn3pow'
-		if nump == 15: model='gauss3_bkn2pow'
-		if nump == 16:  
-			if nf == 4: model='gauss4_bknpow'
-			if nf == 2: model='gauss2_bkn4pow'
-		if nump == 17:  
-			if nf == 5: model='gauss5_pow'
-			if nf == 3: model='gauss3_bkn3pow'
-		if nump == 18: model='gauss4_bkn2pow'
-		if nump == 19:  
-			if nf == 5: model='gauss5_bknpow'
-			if nf == 3: model='gauss3_bkn4pow'
-		if nump == 20:  
-			if nf == 6: model='gauss6_pow'
-			if nf == 4: model='gauss4_bkn3pow'
-		if nump == 21: model='gauss5_bkn2pow'
-		if nump == 22:  
-			if nf == 6: model='gauss6_bknpow'
-			if nf == 4: model='gauss4_bkn4pow'
-		if nump == 23:  
-			if nf == 7: model='gauss7_pow'
-			if nf == 5: model='gauss5_bkn3pow'
-		if nump == 24: model='gauss6_bkn2pow'
-		if nump == 25:  
-			if nf == 7: model='gauss7_bknpow'
-			if nf == 5: model='gauss5_bkn4pow'
-		if nump == 26: model='gauss6_bkn3pow'
-		if nump == 27: model='gauss7_bkn2pow'
-		if nump == 28: model='gauss6_bkn4pow'
-		if nump == 29: model='gauss7_bkn3pow'
-		if nump == 31: model='gauss7_bkn4pow'
+		if (nump >= 2) & (nump-3*nf-2 >= 0):
+			model=fit_functions.model_name(nf,nb)
 
 		p=fit_params(model,pnames,par,pneg,ppos,chisq,dof)
 	
 	return p
 
-class grb_object:
+class lru_cache:
+
+	## bounded least-recently-used cache of loaded burst data
+
+	def __init__(self,maxsize=100):
+		self.maxsize=maxsize
+		self.data=OrderedDict()
+
+	def get(self,key,loader):
+		if key in self.data:
+			value=self.data.pop(key)
+		else:
+			value=loader()
+		self.data[key]=value
+		while len(self.data) > self.maxsize:
+			self.data.popitem(last=False)
+		return value
+
+	def clear(self):
+		self.data.clear()
+
+	def forget(self,dir):
+
+		## drop everything loaded from dir (its files have changed)
+
+		for key in [k for k in self.data if k[1] == dir]:
+			del self.data[key]
 
-	def __init__(self,grb,targid,trigtime,met,lc,p,s):
+## light curves, lc fits & spectral fits loaded by grb_object, shared by all
+## bursts so a long session only holds the most recently used ones
+grb_cache=lru_cache(100)
+
+class grb_object(object):
+
+	## lc, lcfit & specfit are read from dir on first access and kept in
+	## grb_cache. Passing them to the constructor (or assigning them) pins
+	## them to the object instead.
+
+	def __init__(self,grb,targid,trigtime,met,lc=None,p=None,s=None,dir=None):
 
 		self.grb=grb
 		self.targid=targid
 		self.trigtime=trigtime
 		self.met=met
-		self.lc=lc
-		self.lcfit=p
-		self.specfit=s
+		self.dir=dir
+		self._lc=lc
+		self._lcfit=p
+		self._specfit=s
 	#	self=Table(names=('grb','targid','trigtime','met','z','lcfit','lc')) 
 
+	def _load(self,kind,loader):
+		if self.dir is None:
+			return 0
+		return grb_cache.get((kind,self.dir),lambda: loader(self.dir))
+
+	@property
+	def lc(self):
+		if self._lc is not None:
+			return self._lc
+		return self._load('lc',read_lc)
+
+	@lc.setter
+	def lc(self,value):
+		self._lc=value
+
+	@property
+	def lcfit(self):
+		if self._lcfit is not None:
+			return self._lcfit
+		return self._load('lcfit',read_lcfit)
+
+	@lcfit.setter
+	def lcfit(self,value):
+		self._lcfit=value
+
+	@property
+	def specfit(self):
+		if self._specfit is not None:
+			return self._specfit
+		return self._load('specfit',lambda dir: read_specfit(dir=dir))
+
+	@specfit.setter
+	def specfit(self,value):
+		self._specfit=value
+
 	def keys(self):
 		print(['grb','targid','trigtime','met','lc','p','s'])
 
-def load_data(dir=None):
+def read_header(curve_file):
+
+	## MET & trigger time from the T0 line of curve.qdp (2nd line only)
+
+	f=open(curve_file,'r')
+	f.readline()
+	line=f.readline()
+	f.close()
+	tmp=re.split(',|=| ',line)
+	if any("T0 for this burst is Swift" in t for t in tmp):
+		met=float(tmp[9])
+		trigtime=tmp[14]+'-'+str(time.strptime(tmp[15],'%b').tm_mon)+'-'+tmp[16]+' '+tmp[18]
+	else:
+		met=-1
+		trigtime=''
+
+	return met,trigtime
+
+manifest_file='manifest.npz'
+manifest_version=1
+
+def read_manifest(dir):
+
+	## {grb: (targid, met, trigtime, fingerprint)} from the manifest written
+	## by the last load_data, empty if there is none or it is out of date
+
+	file=dir+manifest_file
+	if not os.path.isfile(file):
+		return {}
+	try:
+		with np.load(file) as m:
+			if int(m['version']) != manifest_version:
+				return {}
+			grb=m['grb']
+			targid=m['targid']
+			met=m['met']
+			trigtime=m['trigtime']
+			fingerprint=m['fingerprint']
+	except npz_errors:
+		return {}
+
+	return dict((str(grb[i]),(str(targid[i]),float(met[i]),str(trigtime[i]),fingerprint[i])) \
+		for i in range(len(grb)))
+
+def write_manifest(dir,manifest):
+
+	## store the manifest, atomically like write_lc_cache
+
+	grbs=sorted(manifest.keys())
+	arrays={'version':np.array(manifest_version),
+		'grb':np.array(grbs,dtype=str),
+		'targid':np.array([manifest[g][0] for g in grbs],dtype=str),
+		'met':np.array([manifest[g][1] for g in grbs],dtype=float),
+		'trigtime':np.array([manifest[g][2] for g in grbs],dtype=str),
+		'fingerprint':np.array([manifest[g][3] for g in grbs]).reshape(len(grbs),len(lc_files),2)}
+
+	tmp=dir+manifest_file+'.tmp.npz'
+	try:
+		np.savez_compressed(tmp,**arrays)
+		os.rename(tmp,dir+manifest_file)
+	except (IOError,OSError):
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+def load_data(dir=None,sync=True):
 
 	## Read curve.qdp header for GRB name, trigger number, & trigger time
+	## light curves & fits are only read when first used (see grb_object)
+	## sync - download new & updated bursts first (download_UL), otherwise
+	## use the GRB list from the last sync
+	## headers are kept in dir+'manifest.npz' with the fingerprint of each
+	## burst's light curve files, only new or changed bursts are re-read
 
 	if dir ==None:
 		dir='/Users/jracusin/GRBs/'
-	grbs,targids=download_UL()
+	if sync:
+		grbs,targids=download_UL(dir=dir)
+	else:
+		grbs,targids=read_grblist(dir+'allcurves2.php')
+	manifest=read_manifest(dir)
 	mets=[]
 	trigtimes=[]
 	i=0
 	grblist=[]
 	grbdict={}
+	changed=len(manifest) != len(grbs)
 
 	for grb in grbs:
-		curve_file=dir+grb+'/curve.qdp'
+		gdir=dir+grb+'/'
+		targid=targids[i]
+		fp=lc_fingerprint(gdir)
+		has_curve=fp[lc_files == 'curve.qdp'][0,0] >= 0
+		m=manifest.get(grb)
 
-		if os.path.exists(curve_file):
-			f=open(curve_file,'r')
-			lines=f.readlines()
-			tmp=re.split(',|=| ',lines[1])
-			#print grb,tmp[9]
-			if any("T0 for this burst is Swift" in t for t in tmp):
-				met=float(tmp[9])
-				trigtime=tmp[14]+'-'+str(time.strptime(tmp[15],'%b').tm_mon)+'-'+tmp[16]+' '+tmp[18]
+		if (m is not None) and (m[0] == targid) and np.array_equal(m[3],fp):
+			met,trigtime=m[1],m[2]
+		else:
+			if has_curve:
+				met,trigtime=read_header(gdir+'curve.qdp')
 			else:
 				met=-1
 				trigtime=''
+			## anything already loaded from this burst is stale
+			grb_cache.forget(gdir)
+			manifest[grb]=(targid,met,trigtime,fp)
+			changed=True
 
-			mets=np.append(mets,met)
-			trigtimes=np.append(trigtimes,trigtime)
-
-			targid=targids[i]
-			lc=read_lc(dir+grb+'/')
-			p=read_lcfit(dir+grb+'/')
-			s=read_specfit(dir=dir)
-
+		if has_curve:
 			## create GRB object
-			g=grb_object(grb,targid,trigtime,met,lc,p,s)
+			g=grb_object(grb,targid,trigtime,met,dir=gdir)
 			## add to list
 			grblist.append(g)
 			## add to dictionaries of objects
 			grbdict[g.grb]=g
+		mets=np.append(mets,met)
+		trigtimes=np.append(trigtimes,trigtime)
 		i=i+1
+
+	if changed:
+		for grb in set(manifest.keys())-set(grbs):
+			del manifest[grb]
+		write_manifest(dir,manifest)
 		
 	## make record array
 	c1=fits.Column(name='grb',format='10A',array=grbs)
@@ -682,6 +1756,122 @@ def load_data(dir=None):
 ### create fits record array of all params
 ### have function to grab object for that GRB with fit params & LC?
 
+spec_modes=['WT','PC','PCLATE']
+spec_values=['nh','gamma','flux','unabs_flux']
+spec_scalars=['galnh','cstat','dof','rate','corr','ontime']
+
+def write_catalog(grbdict,file='grb_catalog.fits',lcfits=None):
+
+	## write every burst's light curve fit & spectral fits to one FITS file
+	## HDU 1 (BURSTS): one row per burst - grb, targid, trigtime, met, model,
+	##   nump, chisq, dof, and <mode>_<value>[_errneg,_errpos] for each
+	##   spectral mode. par_start/nump index that burst's rows in HDU 2.
+	## HDU 2 (PARAMS): one row per fitted parameter (variable number per
+	##   burst) - row (index into BURSTS), pname, par, perror_neg, perror_pos
+	## lcfits - optional {grb: fit_params} (e.g. batch_fit.read_catalog_fits)
+	##   used instead of grb.lcfit
+
+	grbs=sorted(grbdict.keys())
+	n=len(grbs)
+	cols={'model':[],'nump':np.zeros(n,dtype=int),'par_start':np.zeros(n,dtype=int),\
+		'chisq':np.zeros(n)+np.nan,'dof':np.zeros(n)+np.nan}
+	for m in spec_modes:
+		for v in spec_values:
+			for e in ['','_errneg','_errpos']:
+				cols[m.lower()+'_'+v+e]=np.zeros(n)+np.nan
+		for v in spec_scalars:
+			cols[m.lower()+'_'+v]=np.zeros(n)+np.nan
+
+	row=[]
+	pnames=[]
+	par=[]
+	perror=[]
+	for i in range(n):
+		g=grbdict[grbs[i]]
+		if lcfits is not None:
+			p=lcfits.get(grbs[i],0)
+		else:
+			p=g.lcfit
+		cols['par_start'][i]=len(row)
+		if p:
+			npar=len(p.par)
+			cols['model'].append(p.model)
+			cols['nump'][i]=npar
+			cols['chisq'][i]=p.chisq
+			cols['dof'][i]=p.dof
+			row=row+[i]*npar
+			pnames=pnames+[str(s) for s in p.pnames]
+			par=par+list(p.par)
+			perror=perror+list(np.reshape(p.perror,(npar,2)))
+		else:
+			cols['model'].append('nofit')
+
+		s=g.specfit or {}
+		for m in s:
+			pre=m.lower()+'_'
+			for v in spec_values:
+				cols[pre+v][i]=getattr(s[m],v)
+				cols[pre+v+'_errneg'][i]=getattr(s[m],v+'_err')[0]
+				cols[pre+v+'_errpos'][i]=getattr(s[m],v+'_err')[1]
+			for v in spec_scalars:
+				try:
+					cols[pre+v][i]=float(getattr(s[m],v))
+				except ValueError:
+					pass
+
+	c=[fits.Column(name='grb',format='10A',array=grbs),
+		fits.Column(name='targid',format='8A',array=[grbdict[g].targid for g in grbs]),
+		fits.Column(name='trigtime',format='23A',array=[grbdict[g].trigtime for g in grbs]),
+		fits.Column(name='met',format='D',array=[grbdict[g].met for g in grbs]),
+		fits.Column(name='model',format='20A',array=cols.pop('model')),
+		fits.Column(name='nump',format='J',array=cols.pop('nump')),
+		fits.Column(name='par_start',format='K',array=cols.pop('par_start'))]
+	for name in ['chisq','dof']+sorted([k for k in cols if k not in ['chisq','dof']]):
+		c.append(fits.Column(name=name,format='D',array=cols[name]))
+	bursts=fits.BinTableHDU.from_columns(c,name='BURSTS')
+
+	perror=np.reshape(perror,(-1,2))
+	params=fits.BinTableHDU.from_columns([
+		fits.Column(name='row',format='K',array=np.array(row,dtype=int)),
+		fits.Column(name='pname',format='12A',array=pnames),
+		fits.Column(name='par',format='D',array=np.array(par,dtype=float)),
+		fits.Column(name='perror_neg',format='D',array=perror[:,0]),
+		fits.Column(name='perror_pos',format='D',array=perror[:,1])],name='PARAMS')
+
+	fits.HDUList([fits.PrimaryHDU(),bursts,params]).writeto(file,overwrite=True)
+
+def read_catalog(file='grb_catalog.fits',memmap=True):
+
+	## returns the (bursts, params) record arrays written by write_catalog
+	## e.g. bursts['grb'][bursts['chisq']/bursts['dof'] < 1.5]
+
+	hdus=fits.open(file,memmap=memmap)
+	bursts=hdus['BURSTS'].data
+	params=hdus['PARAMS'].data
+
+	return bursts,params
+
+def catalog_param(bursts,params,pname,error=False):
+
+	## value of parameter pname for every burst (nan where the model has no
+	## such parameter), aligned with bursts. error=True also returns the
+	## (nbursts,2) negative & positive errors
+	## e.g. pow2=catalog_param(bursts,params,'pow2')
+	##      pow2[bursts['chisq']/bursts['dof'] < 1.5]
+
+	n=len(bursts)
+	sel=np.where(np.char.strip(params['pname']) == pname)[0]
+	val=np.zeros(n)+np.nan
+	val[params['row'][sel]]=params['par'][sel]
+	if not error:
+		return val
+
+	err=np.zeros((n,2))+np.nan
+	err[params['row'][sel],0]=params['perror_neg'][sel]
+	err[params['row'][sel],1]=params['perror_pos'][sel]
+
+	return val,err
+
 class specfit_params:
 
 	def __init__(self,mode,galnh,nh,nh_err_neg,nh_err_pos,gamma,gamma_err_neg,gamma_err_pos,\
@@ -724,7 +1914,7 @@ def read_specfit(dir=''):
 			mode=modes[i]
 			for line in lines:
 				tmp=re.split('\n|\t| |,|\(|\)|=|:',line)
-				tmp=filter(None,tmp)
+				tmp=list(filter(None,tmp))
 #				print tmp
 				if l == 0: galnh=float(tmp[1])
 				if l == 1: 
@@ -774,9 +1964,9 @@ def read_specfit(dir=''):
 			s=specfit_params(mode,galnh,nh,nh_err_neg,nh_err_pos,gamma,gamma_err_neg,gamma_err_pos,\
 				flux,flux_err_neg,flux_err_pos,unabs_flux,unabs_flux_err_neg,unabs_flux_err_pos,\
 				cstat,dof,rate,corr,ontime)
-			i=i+1
 			#spec.append(s)  ## list
 			spec[mode]=s
+		i=i+1
 
 	## make list of specfit objects
 
@@ -804,85 +1994,221 @@ class fit_params:
 
 	### to make list of object: plist=[fit_params(count) for count in xrange(n)]
 
-def read_curve(file):
+qdp_commands=('READ','SKIP','PLOT','LABEL','LA','@','MARKER','LINE','VIEW','CSIZE','TIME','LOG','RESCALE')
+
+def read_qdp(file):
+
+	## single pass reader for Swift XRT qdp light curves
+	## understands QDP commands (READ TERR ...), '!' comment/header lines,
+	## section labels ('! WTSLEW data'), and 'NO NO ...' section separators
+	## returns a list of (label, column names, (nrows,ncols) float array)
 
 	f=open(file,'r')
-	lines=f.readlines()
-	header=[]
-	start=0
-	done=0
-	data=[]
+	lines=f.read().splitlines()
+	f.close()
+
+	sections=[]
+	label=''
+	header=None
+	rows=[]
+
+	def close():
+		if header and rows:
+			text=' '.join(rows)
+			if 'NO' in text:
+				text=re.sub(r'\bNO\b','nan',text)
+			data=np.array(text.split(),dtype=float)
+			sections.append((label,header,data.reshape(len(rows),-1)))
+
 	for line in lines:
 		tmp=line.split()
-		if len(tmp) >0:
-			if (tmp[1] == 'WTSLEW') & (not header):
-				start=1
-				continue
-			if (tmp[1] == 'NO'):
-				break
-			if (start == 1) & (not header):
+		if not tmp:
+			continue
+		first=tmp[0]
+		if first[0] == '!':
+			tmp[0]=first[1:]
+			tmp=[t for t in tmp if t]
+			if tmp and (tmp[0] == 'Time'):
+				close()
 				header=tmp
-#				header[0]='Time'
-				d=Table(names=header)
-				continue
-			if (start == 1) & (len(header)>0):
-				d.add_row(tmp)
-
-	f.close()
+				rows=[]
+			elif len(tmp) > 0 and tmp[0].isupper():
+				close()
+				label=tmp[0]
+				rows=[]
+			continue
+		if first.upper() in qdp_commands:
+			continue
+		if first == 'NO':
+			close()
+			rows=[]
+			label=''
+			continue
+		rows.append(line)
+	close()
+
+	return sections
+
+lc_files=np.array(['WTCURVE.qdp','WTUL.qdp','PCCURVE.qdp','PCUL.qdp','curve.qdp'])
+lc_types=np.array(['WT','WTUL','PC','PCUL','WTSLEW'])
+## errors of reading a missing, truncated or out of date npz file
+npz_errors=(IOError,OSError,KeyError,ValueError,zipfile.BadZipfile)
+
+lc_cache_file='lc_cache.npz'
+lc_cache_version=2
+
+def lc_fingerprint(dir=''):
+
+	## (mtime, size) of each light curve file in dir, -1 if missing
+
+	fp=np.zeros((len(lc_files),2))-1
+	for i in range(len(lc_files)):
+		if os.path.isfile(dir+lc_files[i]):
+			st=os.stat(dir+lc_files[i])
+			fp[i]=[st.st_mtime,st.st_size]
+
+	return fp
+
+def write_lc_cache(dir,d,fp=None):
+
+	## store the assembled light curve as a compressed npz next to the qdp
+	## files, keyed by their fingerprint. Written to a temporary file first
+	## so a crash never leaves a half-written cache
+
+	if fp is None:
+		fp=lc_fingerprint(dir)
+	arrays={'version':np.array(lc_cache_version),'fingerprint':fp,\
+		'columns':np.array(d.colnames)}
+	for c in d.colnames:
+		arrays['col_'+c]=np.array(d[c])
+		if hasattr(d[c],'mask'):
+			arrays['mask_'+c]=np.array(np.ma.getmaskarray(d[c]))
+
+	tmp=dir+lc_cache_file+'.tmp.npz'
+	try:
+		np.savez_compressed(tmp,**arrays)
+		os.rename(tmp,dir+lc_cache_file)
+	except (IOError,OSError):
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+def read_lc_cache(dir,fp=None):
+
+	## light curve from the npz cache, or None if it is missing or the qdp
+	## files have changed since it was written
+
+	file=dir+lc_cache_file
+	if not os.path.isfile(file):
+		return None
+	if fp is None:
+		fp=lc_fingerprint(dir)
+	try:
+		with np.load(file) as c:
+			if (int(c['version']) != lc_cache_version) or \
+				(not np.array_equal(c['fingerprint'],fp)):
+				return None
+			d=Table()
+			for name in c['columns']:
+				name=str(name)
+				if 'mask_'+name in c.files:
+					d.add_column(MaskedColumn(c['col_'+name],name=name,mask=c['mask_'+name]))
+				else:
+					d.add_column(Column(c['col_'+name],name=name))
+	except npz_errors:
+		return None
 
 	return d
 
-def read_lc(dir=''):
+def read_lc(dir='',cache=True):
+
+	## cache - read/write the binary cache (lc_cache.npz) in dir, the qdp files
+	## are only parsed when they have changed since the cache was written
 
-	files=np.array(['WTCURVE.qdp','WTUL.qdp','PCCURVE.qdp','PCUL.qdp','curve.qdp'])
-	type=np.array(['WT','WTUL','PC','PCUL','WTSLEW'])
+	files=lc_files
+	type=lc_types
 	nfiles=len(files)
 	if (len(dir)>0) & ('/' not in dir): 
 		dir=dir+'/'
 
-	start=0
-	itworked=False
+	if cache:
+		fp=lc_fingerprint(dir)
+		d=read_lc_cache(dir,fp=fp)
+		if d is not None:
+			return d
+
+	names=[]
+	blocks=[]
 	for f in range(nfiles):
 		if os.path.isfile(dir+files[f]):
-#			print(files[f])
-#			print f
-			if f<=3:
-				data=ascii.read(dir+files[f],header_start=2,data_start=3)
-				ncol=len(data[0])
-				ndata=len(data)
-				if ncol >16:
-					del data['SYS_NEG','SYS_POS']
-				t=Column(np.repeat(type[f],ndata),name='Type')
-				data.add_column(t)
-				if start==0:
-					d=data
-					start=1
-				else:
-					d=join(d,data,join_type='outer')
-#				print len(d)
-			if f==4:
-				if 'WTSLEW' in open(dir+files[f]).read():
-					data=read_curve(dir+files[f])
-					ndata=len(data)
-					t=Column(np.repeat(type[f],ndata),name='Type')
-					data.add_column(t)
-					d=join(d,data,join_type='outer')
-			itworked=True
-#		print dir+files[f]
-
-	if itworked: 
-		d.rename_column('!Time','Time')
-#		print 'what?'
+			for label,header,data in read_qdp(dir+files[f]):
+				## curve.qdp repeats the WT & PC data, only its WTSLEW part is new
+				if (f == 4) & (label != 'WTSLEW'):
+					continue
+				blocks.append((type[f],header,data))
+				names=names+[h for h in header if (h not in names) & (h not in ['SYS_NEG','SYS_POS'])]
+	itworked=len(blocks) > 0
+
+	if itworked:
+		nrows=sum([len(b[2]) for b in blocks])
+		cols=dict((n,np.zeros(nrows)) for n in names)
+		masks=dict((n,np.ones(nrows,dtype=bool)) for n in names)
+		types=[]
+		i=0
+		for t,header,data in blocks:
+			for j in range(len(header)):
+				if header[j] in cols:
+					cols[header[j]][i:i+len(data)]=data[:,j]
+					masks[header[j]][i:i+len(data)]=False
+			types.append(np.repeat(t,len(data)))
+			i=i+len(data)
+		s=np.argsort(cols['Time'],kind='mergesort')
+
+		d=Table()
+		for n in names:
+			if np.any(masks[n]):
+				d.add_column(MaskedColumn(cols[n][s],name=n,mask=masks[n][s]))
+			else:
+				d.add_column(Column(cols[n][s],name=n))
+		d.add_column(Column(np.hstack(types)[s],name='Type'))
+		if cache:
+			write_lc_cache(dir,d,fp=fp)
 	else: d=0
 
 	return d
 
-def download_UL(update=False,dir=None):
+def read_grblist(filename):
+
+	## GRB names & target IDs from the Swift list of light curves (allcurves2.php)
+
+	f=open(filename,'r')
+	lines=f.readlines()
+	f.close()
+
+	targids=[]
+	grbs=[]
+	for line in lines: 
+		if "<td><p class='grb'>GRB" in line: 
+			tmp=line
+			tmp=re.split('<|>|/',line)
+			targids=np.append(targids,tmp[10])
+			grbs=np.append(grbs,tmp[4].replace(" ",""))
+
+	return grbs,targids
+
+def download_UL(update=False,dir=None,base_url=None,nthreads=8):
+
+	## base_url - server to download from (default download.base_url, the
+	## Swift site), can point at a local mirror or test server
+	## nthreads - number of concurrent downloads
+	## an interrupted sync resumes from dir+'download_journal.txt'
+
+	import download
 
-	import urllib
+	if base_url is None:
+		base_url=download.base_url
 
 	# ### download trigIDs
-	url="http://www.swift.ac.uk/xrt_curves/allcurves2.php"
+	url=base_url+"xrt_curves/allcurves2.php"
 	if dir == None:
 		dir='/Users/jracusin/GRBs/'
 	if os.path.exists(dir+'reftime.dat'):
@@ -895,36 +2221,26 @@ def download_UL(update=False,dir=None):
 
 	filename=dir+'allcurves2.php'
 	if not os.path.exists(filename) or update:
-		if update: os.remove(filename)	
-		urllib.urlretrieve(url,filename)
-		#wget.download(url,filename)
-		print 'downloading GRB list: ', filename
-	f=open(filename,'r')
-	lines=f.readlines()
-
-	targids=[]
-	grbs=[]
-	for line in lines: 
-		if "<td><p class='grb'>GRB" in line: 
-			tmp=line
-			tmp=re.split('<|>|/',line)
-			targids=np.append(targids,tmp[10])
-			grbs=np.append(grbs,tmp[4].replace(" ",""))
+		if update and os.path.exists(filename): os.remove(filename)
+		print('downloading GRB list: '+filename)
+		download.fetch_files([(url,filename)],nthreads=1)
+	grbs,targids=read_grblist(filename)
 
 	# download LCs
 	files=np.array(['curve.qdp','WTCURVE.qdp','WTUL.qdp','PCCURVE.qdp','PCUL.qdp',\
 		'interval0wt_fit.fit','interval0pc_fit.fit','late_timepc_fit.fit'])
 	### figure out spec files logic - right now won't download because curve.qdp exists
 
+	jobs=[]
 	for i in range(len(grbs)):
 		grb=grbs[i]
 		targid=targids[i]
-		dir='/Users/jracusin/GRBs/'+grb+'/'
-		if not os.path.exists(dir): os.makedirs(dir)
+		gdir=dir+grb+'/'
+		if not os.path.exists(gdir): os.makedirs(gdir)
 		fage=-1
 		for file in files:
-			if os.path.exists(dir+file):
-				ftime=os.path.getmtime(dir+file)
+			if os.path.exists(gdir+file):
+				ftime=os.path.getmtime(gdir+file)
 				if file==files[0]:
 					fage=ftime-reftime
 				else: fage=0
@@ -932,21 +2248,19 @@ def download_UL(update=False,dir=None):
 				lcspec='xrt_curves/'
 			else: lcspec='xrt_spectra/'
 			if fage < 0:  # if file created before reftime
-				url="http://www.swift.ac.uk/"+lcspec+targid+"/"+file
-				print 'downloading: ', url
-				print dir+file
-				urllib.urlretrieve(url,dir+file)
-				#wget.download(url,dir+file)
-			if os.path.exists(dir+file):
-				f=open(dir+file,'r')
-				lines=f.readlines()
-				if any("404 page not found" in line for line in lines): 
-					os.remove(dir+file)
-
-
-	fref=open(dir+'reftime.dat','w')
-	reftime=time.time()
-	fref.write(str(reftime))
-	fref.close()
-
-	return grbs,targids
\ No newline at end of file
+				jobs.append((base_url+lcspec+targid+"/"+file,gdir+file))
+
+	print('downloading '+str(len(jobs))+' files')
+	results=download.fetch_files(jobs,nthreads=nthreads,journal=dir+'download_journal.txt')
+	for file in results:
+		## files the server doesn't have must not be left from an earlier sync
+		if (results[file] == 'missing') and os.path.exists(file):
+			os.remove(file)
+
+	if 'failed' not in results.values():
+		fref=open(dir+'reftime.dat','w')
+		reftime=time.time()
+		fref.write(str(reftime))
+		fref.close()
+
+	return grbs,targids
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------------------------------
+
+Affine-invariant ensemble sampler (Goodman & Weare 2010 stretch move)
+
+The walkers are split in two halves and each half is moved at once, so
+lnprob is called with an (nwalkers/2, npar) array of parameter sets and
+must return their log probabilities (-inf outside the prior). Sampling
+stops once the chains are longer than ntau autocorrelation times and the
+estimate of the autocorrelation time has settled. The stored chain is
+thinned as it grows so memory stays bounded (see sample).
+
+------------------------------------------------------------------------
+"""
+
+import numpy as np
+
+def autocorr_time(chain,c=5.):
+
+	## integrated autocorrelation time of each parameter of a chain
+	## (nsteps,nwalkers,npar), from the FFT autocorrelation function
+	## averaged over walkers and Sokal's adaptive window (M >= c*tau).
+	## One parameter at a time, so the float64 padded FFT copy is only
+	## (2*nsteps,nwalkers) however many parameters there are.
+
+	n=chain.shape[0]
+	nfft=1
+	while nfft < 2*n:
+		nfft=nfft*2
+
+	tau=np.empty(chain.shape[2])
+	for i in range(chain.shape[2]):
+		x=np.array(chain[:,:,i],dtype=float)
+		x-=x.mean(axis=0)
+		f=np.fft.rfft(x,n=nfft,axis=0)
+		acf=np.fft.irfft(f*np.conj(f),n=nfft,axis=0)[0:n].mean(axis=1)
+		acf=acf/np.where(acf[0] > 0,acf[0],1.)
+
+		taus=2.*np.cumsum(acf)-1.
+		m=np.where(np.arange(n) >= c*taus)[0]
+		if len(m):
+			tau[i]=taus[m[0]]
+		else:
+			tau[i]=taus[-1]
+
+	return tau
+
+def initial_ball(lnprob,p,scale,nwalkers,rng,maxtries=50):
+
+	## nwalkers starting points around p with spread scale, all with
+	## finite lnprob. The spread is halved for points that are not.
+
+	npar=len(p)
+	x=p+scale*rng.randn(nwalkers,npar)
+	lp=lnprob(x)
+	s=np.array(scale,dtype=float)
+	for i in range(maxtries):
+		bad=~np.isfinite(lp)
+		if not np.any(bad):
+			break
+		s=s/2.
+		x[bad]=p+s*rng.randn(np.sum(bad),npar)
+		lp[bad]=lnprob(x[bad])
+	if not np.all(np.isfinite(lp)):
+		raise ValueError('Could not find valid starting points for the walkers')
+
+	return x,lp
+
+def sample(lnprob,x,lp=None,maxsteps=20000,a=2.,check=250,growth=1.5,maxstore=1000,ntau=50.,\
+	tol=0.05,seed=None,dtype=np.float32,verbose=False):
+
+	## run the stretch move from walker positions x (nwalkers,npar)
+	## checking convergence after check steps, then every time the chain
+	## has grown by a factor growth
+	## The chain is kept as at most maxstore rows of dtype: every step at
+	## first and, each time the buffer fills, every other row is dropped
+	## and positions are stored half as often. Memory is bounded and the
+	## autocorrelation times are estimated on the stored rows.
+	## returns the stored chain (nrows,nwalkers,npar), the number of steps
+	## between its rows, the acceptance fraction, the autocorrelation
+	## times (in steps) and whether it converged
+
+	rng=np.random.RandomState(seed)
+	x=np.array(x,dtype=float)
+	nwalkers,npar=x.shape
+	if nwalkers % 2:
+		raise ValueError('Need an even number of walkers')
+	maxstore=maxstore+maxstore % 2
+	if lp is None:
+		lp=lnprob(x)
+	half=nwalkers//2
+	halves=[np.arange(half),np.arange(half,nwalkers)]
+
+	store=np.empty((maxstore,nwalkers,npar),dtype=dtype)
+	nstore=0
+	step=1
+	accepted=0
+	nsteps=0
+	nextcheck=check
+	tau=np.zeros(npar)+np.inf
+	converged=False
+	while nsteps < maxsteps:
+		for h in range(2):
+			move=halves[h]
+			other=halves[1-h]
+			z=((a-1.)*rng.rand(half)+1.)**2/a
+			partner=x[other[rng.randint(half,size=half)]]
+			y=partner+z[:,np.newaxis]*(x[move]-partner)
+			lpy=lnprob(y)
+			lnr=(npar-1.)*np.log(z)+lpy-lp[move]
+			acc=np.log(rng.rand(half)) < lnr
+			x[move[acc]]=y[acc]
+			lp[move[acc]]=lpy[acc]
+			accepted=accepted+np.sum(acc)
+		nsteps=nsteps+1
+
+		if nsteps % step == 0:
+			store[nstore]=x
+			nstore=nstore+1
+			if nstore == maxstore:
+				## rows at steps 2*step, 4*step, ... are kept
+				store[0:maxstore//2]=store[1::2]
+				nstore=maxstore//2
+				step=2*step
+
+		if nsteps >= nextcheck:
+			nextcheck=max(int(nsteps*growth),nsteps+1)
+			old=tau
+			tau=autocorr_time(store[0:nstore])*step
+			if verbose:
+				print(str(nsteps)+' steps, tau = '+str(np.round(tau,1)))
+			if np.all(nsteps > ntau*tau) and np.all(abs(old-tau) < tol*tau):
+				converged=True
+				break
+
+	return store[0:nstore].copy(),step,accepted/float(nsteps*nwalkers),tau,converged
+
+def thin_chain(chain,tau,maxsamples=None,step=1):
+
+	## flat samples after discarding 2 autocorrelation times of burn-in and
+	## thinning by half the shortest one, at most maxsamples of them
+	## step - number of steps between the rows of chain (see sample)
+
+	tau=np.where(np.isfinite(tau),tau,step*chain.shape[0]/50.)/step
+	burn=min(int(2*np.max(tau)),chain.shape[0]//2)
+	thin=max(int(0.5*np.min(tau)),1)
+	samples=chain[burn::thin].reshape(-1,chain.shape[2])
+	if maxsamples and (len(samples) > maxsamples):
+		samples=samples[np.linspace(0,len(samples)-1,maxsamples).astype(int)]
+
+	return samples
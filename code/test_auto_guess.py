@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+------------------------------------------------------------------------
+
+Checks that auto_initial_conditions finds known flares
+
+Synthetic bin-integrated light curves of a broken power law with two
+gaussian flares, each doubling the flux at its peak, with 10% errors.
+
+python -m pytest test_auto_guess.py
+
+------------------------------------------------------------------------
+"""
+
+import numpy as np
+import fit_lc
+import fit_functions
+
+continuum=[1e3,0.8,3000.,1.6]
+flare_times=[300.,8000.]
+
+def synthetic_lc(seed,nbins=200,width=0.1):
+
+	## light curve dictionary with the columns auto_initial_conditions uses
+
+	rng=np.random.RandomState(seed)
+	e=np.logspace(1.7,5.5,nbins+1)
+	t=np.sqrt(e[1:]*e[:-1])
+	p=list(continuum)
+	for tc in flare_times:
+		p=p+[fit_functions.models['bknpow'](np.array([tc]),*continuum)[0],tc,width*tc]
+	y=fit_functions.models['intgauss2_bknpow'](np.vstack((e[:-1],e[1:])),*p)
+	err=0.1*y
+
+	return {'Time':t,'T_+ve':e[1:]-t,'T_-ve':e[:-1]-t,'Rate':y+err*rng.randn(nbins),\
+		'Ratepos':err,'Rateneg':-err,'Type':np.where(t < 500,'WT','PC')}
+
+def found_flares(p0,model,fmodel):
+
+	## True if there is a flare guess within 0.15 dex of each true flare
+
+	f=fmodel[model]
+	times=np.array([p0[f.ncont+1+3*i] for i in range(f.numflares)])
+
+	return all(np.any(abs(np.log10(times/tc)) < 0.15) for tc in flare_times)
+
+def test_finds_flares():
+	for seed in range(1,6):
+		p0,model,fmodel,pnames=fit_lc.auto_initial_conditions(lc=synthetic_lc(seed))
+		assert fmodel[model].numflares == 2, (seed,model)
+		assert found_flares(p0,model,fmodel), (seed,model,p0)
+
+def test_forced_flares():
+	for seed in range(1,6):
+		p0,model,fmodel,pnames=fit_lc.auto_initial_conditions(lc=synthetic_lc(seed),numflares=2)
+		assert fmodel[model].numflares == 2, (seed,model)
+		assert found_flares(p0,model,fmodel), (seed,model,p0)
+
+def test_no_flares():
+	lc=synthetic_lc(1)
+	lc['Rate']=fit_functions.models['bknpow'](lc['Time'],*continuum)*(1+0.1*np.random.RandomState(1).randn(len(lc['Time'])))
+	p0,model,fmodel,pnames=fit_lc.auto_initial_conditions(lc=lc)
+	assert fmodel[model].numflares == 0, model